@@ -0,0 +1,153 @@
+import json
+import re
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Default number of characters pulled from the stream at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Keys of the vectorSet the converters are looked up by (see registry.lookup); when one of
+# them only comes after testGroups, it is read before the test groups are handed out.
+REQUIRED_KEYS = ('algorithm',)
+
+
+class ACVPStreamReader(object):
+    """Incremental reader for ACVP vector sets.
+
+    A vector set is always shaped like [header, vectorSet] where the vectorSet
+    carries a (potentially huge) testGroups array.  Rather than reading the whole
+    document and handing it to json.loads, we walk the envelope by hand and only
+    hand json one value at a time.  The buffer only ever holds the value being
+    decoded plus one chunk of read-ahead, so peak memory follows the largest test
+    group rather than the whole file.
+    """
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        # Stream offset of self._buf[0], to come back to the test groups (see envelope)
+        self._base = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        # Drop whatever has already been consumed so the buffer doesn't grow with the file.
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._base += self._pos
+            self._pos = 0
+        data = self._stream.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+        self._buf += data
+        return bool(data)
+
+    def _skip_ws(self):
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or self._eof:
+                return
+            self._fill()
+
+    def _expect(self, chars):
+        self._skip_ws()
+        if self._pos >= len(self._buf):
+            raise ValueError("Unexpected end of ACVP document; expected one of %r" % chars)
+        c = self._buf[self._pos]
+        if c not in chars:
+            raise ValueError("Unexpected %r in ACVP document; expected one of %r" % (c, chars))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._skip_ws()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A scalar right at the end of the buffer (e.g. a number) may have been cut short.
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            # Grow the read size with the pending value so big groups are not re-decoded over and over.
+            self._fill(max(self._chunk_size, len(self._buf) - self._pos))
+
+    def envelope(self):
+        """Return [header, vectorSet] with vectorSet['testGroups'] as a generator.
+
+        Only the keys which precede testGroups are available up front; any keys that follow
+        it are added to the vectorSet once the generator has been exhausted.  The exception
+        are REQUIRED_KEYS: when one of them has not been seen by testGroups, the test groups
+        are read past (one at a time) for the keys after them, then the stream is rewound to
+        them.  A stream which cannot seek (a pipe) has its test groups decoded into a list
+        instead.
+        """
+        self._expect('[')
+        header = self._value()
+        self._expect(',')
+        self._expect('{')
+
+        vector_set = {}
+        if self._expect('"}') == '}':
+            return [header, vector_set]
+        self._pos -= 1
+
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'testGroups':
+                if all(k in vector_set for k in REQUIRED_KEYS):
+                    vector_set[key] = self._test_groups(vector_set)
+                else:
+                    vector_set[key] = self._test_groups_ahead(vector_set)
+                return [header, vector_set]
+            vector_set[key] = self._value()
+            if self._expect(',}') == '}':
+                self._expect(']')
+                return [header, vector_set]
+
+    def _test_groups_ahead(self, vector_set):
+        self._skip_ws()
+        start = self._base + self._pos
+        try:
+            self._stream.seek(start)
+        except (AttributeError, IOError, OSError):
+            return list(self._test_groups(vector_set))
+        self._stream.seek(self._base + len(self._buf))
+
+        for _ in self._test_groups(vector_set):
+            pass
+        self._stream.seek(start)
+        self._buf = ''
+        self._pos = 0
+        self._base = start
+        self._eof = False
+        return self._test_groups(vector_set)
+
+    def _test_groups(self, vector_set):
+        self._expect('[')
+        self._skip_ws()
+        if self._buf[self._pos:self._pos + 1] == ']':
+            self._pos += 1
+        else:
+            while True:
+                yield self._value()
+                if self._expect(',]') == ']':
+                    break
+
+        # Pick up anything trailing the testGroups array.
+        while self._expect(',}') == ',':
+            key = self._value()
+            self._expect(':')
+            vector_set[key] = self._value()
+        self._expect(']')
+
+
+def load(stream, chunk_size=CHUNK_SIZE):
+    """Incrementally parse an ACVP vector set from a file-like object.
+    Returns the [header, vectorSet] envelope; testGroups is yielded one group at a time."""
+    return ACVPStreamReader(stream, chunk_size).envelope()
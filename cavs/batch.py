@@ -0,0 +1,348 @@
+"""Convert a whole directory (or glob) of ACVP vector sets into CAVS files.
+
+Each vector set is converted into its own sub-directory of the output directory,
+named after the input file, since several vector sets share legacy file names
+(HMAC.req for instance).  Files are spread over a process pool.
+
+    python cavs/batch.py -o out/ -j 8 vectors/ more/*.json
+
+With --archive everything goes into a single tar, tar.gz or zip (or a tar on stdout)
+instead, with the same sub-directories as member names:
+
+    python cavs/batch.py --archive validation.tar.gz vectors/
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import acvpjson
+import cache
+import emit
+import instrument
+import registry
+
+
+def expand_inputs(paths):
+    """Directories expand to the .json files inside them, anything else is treated as a glob."""
+    res = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, '*.json'))
+        else:
+            matches = glob.glob(path)
+        for m in sorted(matches):
+            if m not in res:
+                res.append(m)
+    return res
+
+
+def output_dir_for(path, out_root):
+    return os.path.join(out_root, os.path.splitext(os.path.basename(path))[0])
+
+
+# Name of the conversion plan written next to the legacy files with --dump-plan
+PLAN_FILENAME = "conversion-plan.json"
+
+# Options understood by convert_file, and their defaults
+DEFAULT_OPTIONS = {
+    "dump_plan": False,
+    "buffer_size": emit.DEFAULT_BUFFER_SIZE,
+    "compact_model": False,
+    "cache_dir": None,
+    "cache_max_bytes": cache.DEFAULT_MAX_BYTES,
+    "cache_link": False,
+    "incremental": False,
+    "metrics": False,
+    "group_workers": 1,
+    "pipeline": False,
+    "answers": False,
+}
+
+
+def cache_extra(opts):
+    """What the output of a conversion depends on besides the vector set, for the cache key."""
+    return ("plan" if opts["dump_plan"] else "") + ("answers" if opts["answers"] else "")
+
+
+def convert_file(path, out_root, options=None):
+    """Convert a single vector set. Never raises; failures are reported in the result.
+    With the metrics option, what was measured is returned in the result as "events"
+    for instrument.replay() (the sinks live in the parent process)."""
+    opts = dict(DEFAULT_OPTIONS)
+    opts.update(options or {})
+    if not opts["metrics"]:
+        return _convert_file(path, out_root, opts)
+    with instrument.capture() as recorder:
+        result = _convert_file(path, out_root, opts)
+    result["events"] = recorder.events
+    return result
+
+
+def _convert_file(path, out_root, opts):
+    result = {"path": path, "ok": False, "algorithm": None, "files": [], "written": 0, "error": None, "cache": None}
+    start = time.time()
+    try:
+        out_dir = output_dir_for(path, out_root)
+        if opts["cache_dir"]:
+            # The input file as stored is the key, so a hit costs no parsing at all
+            c = cache.ConversionCache(opts["cache_dir"], opts["cache_max_bytes"], opts["cache_link"])
+            key = cache.file_digest(path, cache_extra(opts))
+            if not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            files = c.fetch(key, out_dir)
+            if files is not None:
+                emit.Manifest.discard(out_dir)
+                result["files"] = [f for f in files if f != PLAN_FILENAME]
+                result["written"] = len(result["files"])
+                result["ok"] = True
+                result["cache"] = c.stats()
+                result["seconds"] = time.time() - start
+                instrument.count("vector_sets", result="cached")
+                return result
+        else:
+            c = None
+
+        with open(path) as f:
+            with instrument.span("parse"):
+                j = acvpjson.load(f)
+            result["algorithm"] = j[1].get('algorithm')
+            a = registry.for_json(j)
+            if opts["compact_model"]:
+                a.use_model()
+            if opts["group_workers"] > 1:
+                a.use_workers(opts["group_workers"])
+
+            if not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            if opts["pipeline"]:
+                result["files"] = a.to_cavs(out_dir, buffer_size=opts["buffer_size"], pipeline=True)
+            else:
+                plan = a.legacy_plan()
+                if opts["dump_plan"]:
+                    with open(os.path.join(out_dir, PLAN_FILENAME), "wt") as p:
+                        plan.dump(p)
+                result["files"] = a.to_cavs(out_dir, plan, opts["buffer_size"], incremental=opts["incremental"],
+                                            answers=opts["answers"])
+            result["written"] = len(a.written_files)
+            result["removed"] = a.removed_files
+            if c is not None:
+                c.store(key, out_dir, result["files"] + ([PLAN_FILENAME] if opts["dump_plan"] else []))
+                result["cache"] = c.stats()
+        result["ok"] = True
+    except Exception as ex:
+        result["error"] = "%s: %s" % (ex.__class__.__name__, ex)
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.time() - start
+    instrument.observe("convert", result["seconds"], algorithm=result["algorithm"])
+    instrument.count("vector_sets", result="converted" if result["ok"] else "failed")
+    return result
+
+
+# Name of the result for the HMAC vector sets merged with --merge-hmac
+MERGED_HMAC = "<merged HMAC vector sets>"
+
+
+def is_hmac(path):
+    """Whether the vector set at path is an HMAC one; only its envelope is read.  One which
+    cannot be read is not taken for HMAC; converting it on its own reports it as failed."""
+    import hmac
+    try:
+        with open(path) as f:
+            return isinstance(registry.lookup(acvpjson.load(f)[1]), hmac.HMAC)
+    except (IOError, OSError, ValueError, registry.NoConverter):
+        return False
+
+
+def merge_hmac(paths, out, buffer_size=emit.DEFAULT_BUFFER_SIZE):
+    """Merge the HMAC vector sets in paths into one HMAC.req in out (a directory or a
+    writer).  Never raises; the result looks like those of convert_file."""
+    import hmac
+    result = {"path": MERGED_HMAC, "ok": False, "algorithm": "HMAC", "files": [], "written": 0, "error": None, "cache": None}
+    start = time.time()
+    try:
+        if isinstance(out, basestring) and not os.path.isdir(out):
+            os.makedirs(out)
+        with instrument.span("merge_hmac"):
+            result["files"] = [hmac.merge_files(paths, out, buffer_size)]
+        result["written"] = 1
+        result["ok"] = True
+    except Exception as ex:
+        result["error"] = "%s: %s" % (ex.__class__.__name__, ex)
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def _convert_file_star(args):
+    return convert_file(*args)
+
+
+def iter_convert(paths, out_root, workers=None, options=None):
+    """Convert every vector set in paths, yielding the results in input order as they
+    become available.  workers defaults to one per CPU."""
+    jobs = [(path, out_root, options) for path in paths]
+    if workers != 1 and len(jobs) > 1:
+        # Only paid for when there is something to spread over processes
+        from multiprocessing import Pool, cpu_count
+        workers = workers or cpu_count()
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield convert_file(*job)
+        return
+
+    pool = Pool(workers)
+    try:
+        for result in pool.imap(_convert_file_star, jobs, chunksize=1):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def convert_all(paths, out_root, workers=None, options=None):
+    """Convert every vector set in paths; results come back in input order."""
+    return list(iter_convert(paths, out_root, workers, options))
+
+
+def convert_to_archive(paths, archive, workers=None, options=None, fmt=None, merge=()):
+    """Convert every vector set in paths into a single archive (see emit.open_archive).
+    The workers convert into a scratch directory; the files of every vector set are
+    appended to the archive, in input order, as soon as it is done and then deleted.
+    The HMAC vector sets in merge end up in a single HMAC.req at the top of the archive."""
+    opts = dict(DEFAULT_OPTIONS)
+    opts.update(options or {})
+    scratch = tempfile.mkdtemp(prefix="cavs-batch-")
+    writer = emit.open_archive(archive, fmt, opts["buffer_size"])
+    results = []
+    try:
+        for r in iter_convert(paths, scratch, workers, opts):
+            out_dir = output_dir_for(r["path"], scratch)
+            if r["ok"]:
+                name = os.path.basename(out_dir)
+                files = r["files"] + ([PLAN_FILENAME] if opts["dump_plan"] else [])
+                for filename in files:
+                    writer.write_file("%s/%s" % (name, filename), os.path.join(out_dir, filename))
+            shutil.rmtree(out_dir, ignore_errors=True)
+            results.append(r)
+        if merge:
+            results.append(merge_hmac(merge, writer, opts["buffer_size"]))
+    except:
+        writer.abort()
+        raise
+    else:
+        writer.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def print_summary(results, stream=sys.stdout):
+    for r in results:
+        if r["ok"] and r.get("removed"):
+            print >> stream, "OK    %s (%s): %d file(s), %d rewritten, %d removed (%s) in %.2fs" % (
+                r["path"], r["algorithm"] or "cached", len(r["files"]), r["written"], len(r["removed"]), ", ".join(r["removed"]), r["seconds"])
+        elif r["ok"] and r["written"] != len(r["files"]):
+            print >> stream, "OK    %s (%s): %d file(s), %d rewritten in %.2fs" % (r["path"], r["algorithm"] or "cached", len(r["files"]), r["written"], r["seconds"])
+        elif r["ok"]:
+            print >> stream, "OK    %s (%s): %d file(s) in %.2fs" % (r["path"], r["algorithm"] or "cached", len(r["files"]), r["seconds"])
+        else:
+            print >> stream, "FAIL  %s (%s): %s" % (r["path"], r["algorithm"], r["error"])
+    failed = len([r for r in results if not r["ok"]])
+    print >> stream, "%d vector set(s), %d converted, %d failed" % (len(results), len(results) - failed, failed)
+    stats = [r["cache"] for r in results if r.get("cache")]
+    if stats:
+        print >> stream, "cache: %d hit(s), %d miss(es), %d eviction(s)" % tuple(
+            sum(s[k] for s in stats) for k in ("hits", "misses", "evictions"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert ACVP vector sets to CAVS files in parallel.")
+    parser.add_argument("inputs", nargs="+", help="vector set files, directories or globs")
+    parser.add_argument("-o", "--out-dir", default=".", help="output root; one sub-directory per vector set")
+    parser.add_argument("--archive", metavar="PATH", help="write everything into one archive instead: .tar, .tar.gz/.tgz, .zip, or - for a tar on stdout")
+    parser.add_argument("--archive-format", choices=[fmt for fmt, _ in emit.ARCHIVE_FORMATS], help="archive format when PATH does not tell")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--merge-hmac", action="store_true", help="merge all the HMAC vector sets into a single HMAC.req at the top of the output")
+    parser.add_argument("--dump-plan", action="store_true", help="write the conversion plan as %s next to the output" % PLAN_FILENAME)
+    parser.add_argument("--buffer-size", type=int, default=emit.DEFAULT_BUFFER_SIZE, help="output buffer size in bytes (default: %(default)s)")
+    parser.add_argument("--compact-model", action="store_true", help="hold test groups in the compact model (less memory)")
+    parser.add_argument("--group-workers", type=int, default=1, metavar="N", help="classify and render the test groups of each vector set on N processes; vector sets are then converted one at a time")
+    parser.add_argument("--pipeline", action="store_true", help="convert the test groups of each vector set one at a time, releasing them as they are written (flat memory)")
+    parser.add_argument("--answers", action="store_true", help="also write .rsp and .fax files with the expected results the vector sets carry")
+    parser.add_argument("--cache-dir", help="reuse the output of earlier conversions of identical vector sets kept here")
+    parser.add_argument("--cache-max-bytes", type=int, default=cache.DEFAULT_MAX_BYTES, help="size cap of the cache; least recently used entries go first (default: %(default)s)")
+    parser.add_argument("--cache-link", action="store_true", help="hard link files from the cache instead of copying them; faster, but an output file edited in place changes the cache too")
+    parser.add_argument("--incremental", action="store_true", help="only rewrite the files whose test groups changed since the last --incremental run")
+    parser.add_argument("--metrics-jsonl", metavar="PATH", help="append spans, counters and events to PATH as JSON lines")
+    parser.add_argument("--metrics-textfile", metavar="PATH", help="write aggregated metrics to PATH in the Prometheus text format")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print tracebacks for failed conversions")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("no vector sets found")
+    if args.pipeline and (args.incremental or args.dump_plan or args.group_workers > 1):
+        parser.error("--pipeline does not go with --incremental, --dump-plan or --group-workers")
+    if args.answers and (args.pipeline or args.incremental):
+        parser.error("--answers does not go with --pipeline or --incremental")
+    if args.archive and args.incremental:
+        parser.error("--incremental needs an output directory, not an archive")
+    if args.archive and not args.archive_format and not emit.archive_format(args.archive):
+        parser.error("cannot tell the archive format of %s; use --archive-format" % args.archive)
+
+    options = {
+        "dump_plan": args.dump_plan,
+        "buffer_size": args.buffer_size,
+        "compact_model": args.compact_model,
+        "cache_dir": args.cache_dir,
+        "cache_max_bytes": args.cache_max_bytes,
+        "cache_link": args.cache_link,
+        "incremental": args.incremental,
+        "metrics": bool(args.metrics_jsonl or args.metrics_textfile),
+        "group_workers": args.group_workers,
+        "pipeline": args.pipeline,
+        "answers": args.answers,
+    }
+    # Pool workers cannot have pools of their own
+    jobs = 1 if args.group_workers > 1 else args.jobs
+    if args.metrics_jsonl:
+        instrument.add_sink(instrument.JSONLinesSink(args.metrics_jsonl))
+    if args.metrics_textfile:
+        instrument.add_sink(instrument.PrometheusTextfileSink(args.metrics_textfile))
+
+    merge = []
+    if args.merge_hmac:
+        merge = [path for path in paths if is_hmac(path)]
+        paths = [path for path in paths if path not in merge]
+
+    if args.archive:
+        try:
+            results = convert_to_archive(paths, args.archive, jobs, options, args.archive_format, merge)
+        except ValueError as ex:
+            parser.error(str(ex))
+    else:
+        results = convert_all(paths, args.out_dir, jobs, options)
+        if merge:
+            with instrument.capture() as recorder:
+                results.append(merge_hmac(merge, args.out_dir, args.buffer_size))
+            results[-1]["events"] = recorder.events
+    for r in results:
+        instrument.replay(r.pop("events", []))
+    instrument.close()
+    # Keep stdout for the archive when it goes there
+    print_summary(results, sys.stderr if args.archive == '-' else sys.stdout)
+    if args.verbose:
+        for r in results:
+            if not r["ok"]:
+                print >> sys.stderr, r["traceback"]
+
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""Benchmark the converters on synthetic vector sets (see vectorgen.py).
+
+Every vector set is converted in a fresh interpreter, once per repeat, and each phase
+of to_cavs is timed on its own:
+
+    parse       reading the JSON (with --stream, the streaming reader only reads the
+                header here and the test groups are parsed during preprocess)
+    preprocess  legacy_preprocess: sub type classification and indexing
+    plan        legacy_file_groups
+    render      rendering the legacy files
+    write       writing the rendered text out (the time spent in write calls; rendering
+                is lazy and interleaved with it, as in to_cavs)
+
+The peak resident size of the interpreter and the output rate in MB/s (output bytes
+over the render and write time) are recorded too.  Results are written as JSON
+and can be compared against an earlier run:
+
+    python cavs/bench.py -s 4 -o after.json --baseline before.json
+
+With --startup, the command line is timed from interpreter start to exit instead: a
+bare interpreter, importing batch.py and each converter module, and batch.py converting
+small vector sets (STARTUP_CASES by default), where importing is most of the time:
+
+    python cavs/bench.py --startup -r 10 -o startup.json
+"""
+import argparse
+import imp
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import vectorgen
+
+PHASES = ("parse", "preprocess", "plan", "render", "write")
+
+# Version of the results format
+RESULTS_VERSION = 1
+
+# Vector sets converted by --startup unless others are named
+STARTUP_CASES = ("SHA-1", "HMAC-SHA2-256", "AES-CTR")
+
+# Modules whose import --startup times on its own
+STARTUP_IMPORTS = ("batch", "aes", "sha", "hmac")
+
+
+def _rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(path, out_dir, stream=False, compact_model=False):
+    """Convert the vector set at path into out_dir phase by phase; return the timings.
+    Meant to run in an interpreter of its own so the peak memory is that of one conversion."""
+    import acvpjson
+    import emit
+    import registry
+    from plan import ConversionPlan
+
+    clock = timeit.default_timer
+    phases = {}
+    base_rss = _rss_kb()
+
+    start = clock()
+    with open(path) as f:
+        j = acvpjson.load(f) if stream else json.load(f)
+        a = registry.for_json(j)
+        if compact_model:
+            a.use_model()
+        phases["parse"] = clock() - start
+
+        start = clock()
+        a.legacy_preprocess()
+        phases["preprocess"] = clock() - start
+
+    start = clock()
+    plan = ConversionPlan.from_file_groups(a.legacy_file_groups())
+    phases["plan"] = clock() - start
+
+    writer = emit.DirectoryWriter(out_dir)
+    emitting = write = 0.0
+    output_bytes = 0
+    for file_groups in plan:
+        start = clock()
+        with writer.open(file_groups["filename"]) as output:
+            for chunk in a.render_legacy_file(file_groups, 0):
+                t = clock()
+                output.write(chunk)
+                write += clock() - t
+                output_bytes += len(chunk)
+        emitting += clock() - start
+    phases["render"] = emitting - write
+    phases["write"] = write
+
+    return {
+        "phases": phases,
+        "total": sum(phases.values()),
+        "groups": len(a.testGroups),
+        "tests": sum(len(tg['tests']) for tg in a.testGroups),
+        "files": len(plan),
+        "output_bytes": output_bytes,
+        "mb_per_s": output_bytes / emitting / (1024 * 1024) if emitting else None,
+        "base_rss_kb": base_rss,
+        "peak_rss_kb": _rss_kb(),
+    }
+
+
+def _run_child(path, options, verbose=False):
+    """run_case in a new interpreter."""
+    out_dir = tempfile.mkdtemp(prefix="cavs-bench-")
+    fd, result_path = tempfile.mkstemp(prefix="cavs-bench-", suffix=".json")
+    os.close(fd)
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-case", path, out_dir, result_path]
+        if options["stream"]:
+            cmd.append("--stream")
+        if options["compact_model"]:
+            cmd.append("--compact-model")
+        with open(os.devnull, "w") as devnull:
+            # Keep whatever the child prints out of the results table
+            subprocess.check_call(cmd, stdout=None if verbose else devnull)
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.unlink(result_path)
+
+
+def bench(names, data_dir, scale=1, repeat=3, options=None, verbose=False):
+    """Generate the named vector sets into data_dir and benchmark them; return the results."""
+    options = dict({"stream": False, "compact_model": False}, **(options or {}))
+    # Only whether it is there; the conversions import it in their own interpreters
+    try:
+        imp.find_module('numpy')
+        has_numpy = True
+    except ImportError:
+        has_numpy = False
+
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": has_numpy,
+        "scale": scale,
+        "repeat": repeat,
+        "options": options,
+        "cases": [],
+    }
+    print >> sys.stderr, format_header()
+    for path in vectorgen.write(data_dir, scale, names):
+        name = os.path.splitext(os.path.basename(path))[0]
+        runs = [_run_child(path, options, verbose) for _ in xrange(repeat)]
+        case = {
+            "name": name,
+            "input_bytes": os.path.getsize(path),
+            # Best of the runs for every phase; the least disturbed by the rest of the machine
+            "phases": dict((phase, min(r["phases"][phase] for r in runs)) for phase in PHASES),
+            "peak_rss_kb": max(r["peak_rss_kb"] for r in runs),
+            "mb_per_s": max(r["mb_per_s"] for r in runs),
+            "runs": runs,
+        }
+        for k in ("groups", "tests", "files", "output_bytes", "base_rss_kb"):
+            case[k] = runs[0][k]
+        case["total"] = sum(case["phases"].values())
+        results["cases"].append(case)
+        print >> sys.stderr, format_case(case)
+    return results
+
+
+def _best_wall_time(cmd, repeat):
+    """Best wall clock time of running cmd repeat times."""
+    best = None
+    with open(os.devnull, "w") as devnull:
+        for _ in xrange(repeat):
+            start = timeit.default_timer()
+            subprocess.check_call(cmd, stdout=devnull)
+            seconds = timeit.default_timer() - start
+            best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def startup(names, data_dir, scale=1, repeat=10):
+    """Time the command line from interpreter start to exit, best of repeat runs each:
+    a bare interpreter, importing each of STARTUP_IMPORTS, and batch.py converting each
+    of the named vector sets in a single process."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": repeat,
+        "startup": [],
+    }
+
+    def run(name, cmd):
+        entry = {"name": name, "seconds": _best_wall_time(cmd, repeat)}
+        results["startup"].append(entry)
+        print >> sys.stderr, format_startup(entry)
+
+    out_dir = tempfile.mkdtemp(prefix="cavs-bench-")
+    try:
+        run("python", [sys.executable, "-c", "pass"])
+        for module in STARTUP_IMPORTS:
+            run("import %s" % module, [sys.executable, "-c", "import sys; sys.path.insert(0, %r); import %s" % (here, module)])
+        for path in vectorgen.write(data_dir, scale, names):
+            name = os.path.splitext(os.path.basename(path))[0]
+            run(name, [sys.executable, os.path.join(here, "batch.py"), "-j", "1", "-o", out_dir, path])
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return results
+
+
+def format_startup(entry, baseline=None):
+    ms = entry["seconds"] * 1000
+    if baseline:
+        old = baseline["seconds"] * 1000
+        return "%-20s %8.1f ms %+6.1f%% (was %.1f ms)" % (entry["name"], ms, (ms - old) * 100.0 / old, old)
+    return "%-20s %8.1f ms" % (entry["name"], ms)
+
+
+def compare_startup(results, baseline, threshold=None, stream=sys.stdout):
+    """compare() for --startup results."""
+    old_entries = dict((e["name"], e) for e in baseline.get("startup", []))
+    slower = []
+    for entry in results["startup"]:
+        old = old_entries.get(entry["name"])
+        print >> stream, format_startup(entry, old)
+        if threshold is not None and old and entry["seconds"] > old["seconds"] * (1 + threshold / 100.0):
+            slower.append(entry["name"])
+    return slower
+
+
+def format_header():
+    return "%-14s %s %11s %13s" % ("case", " ".join("%-16s" % p for p in PHASES + ("total",)), "peak rss", "output rate")
+
+
+def format_case(case, baseline=None):
+    def cell(value, old):
+        if old:
+            return "%8.4fs %+6.1f%%" % (value, (value - old) * 100.0 / old)
+        return "%8.4fs        " % value
+    old = baseline or {"phases": {}}
+    cells = [cell(case["phases"][phase], old["phases"].get(phase)) for phase in PHASES]
+    cells.append(cell(case["total"], old.get("total")))
+    return "%-14s %s %8d KB %8.1f MB/s" % (case["name"], " ".join(cells), case["peak_rss_kb"], case["mb_per_s"] or 0)
+
+
+def compare(results, baseline, threshold=None, stream=sys.stdout):
+    """Print the cases next to the baseline results; return the names of the cases whose
+    total time went up by more than threshold percent."""
+    old_cases = dict((c["name"], c) for c in baseline["cases"])
+    print >> stream, format_header()
+    slower = []
+    for case in results["cases"]:
+        old = old_cases.get(case["name"])
+        print >> stream, format_case(case, old)
+        if threshold is not None and old and case["total"] > old["total"] * (1 + threshold / 100.0):
+            slower.append(case["name"])
+    return slower
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "--run-case":
+        # Child side of _run_child
+        path, out_dir, result_path = argv[1:4]
+        result = run_case(path, out_dir, "--stream" in argv, "--compact-model" in argv)
+        with open(result_path, "wt") as f:
+            json.dump(result, f)
+        return 0
+
+    names = [name for name, _ in vectorgen.vector_sets()]
+    parser = argparse.ArgumentParser(description="Benchmark the ACVP to CAVS converters on synthetic vector sets.")
+    parser.add_argument("cases", nargs="*", metavar="case", help="vector sets to run (default: all of %s)" % ", ".join(names))
+    parser.add_argument("-s", "--scale", type=int, default=1, help="multiply the number of test cases (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per vector set; the best is kept (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="write the results as JSON here")
+    parser.add_argument("--data-dir", help="keep the generated vector sets here (default: a temporary directory)")
+    parser.add_argument("--stream", action="store_true", help="parse with the streaming reader")
+    parser.add_argument("--compact-model", action="store_true", help="hold test groups in the compact model")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--fail-over", type=float, metavar="PERCENT", help="with --baseline, exit with 1 if a total went up by more than PERCENT")
+    parser.add_argument("-v", "--verbose", action="store_true", help="let the benchmarked conversions print")
+    parser.add_argument("--startup", action="store_true",
+                        help="time interpreter start, imports and batch.py on small vector sets (default: %s) instead" % ", ".join(STARTUP_CASES))
+    args = parser.parse_args(argv)
+
+    for case in args.cases:
+        if case not in names:
+            parser.error("unknown case %s" % case)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="cavs-bench-data-")
+    try:
+        if args.startup:
+            results = startup(args.cases or STARTUP_CASES, data_dir, args.scale, args.repeat)
+        else:
+            results = bench(args.cases or None, data_dir, args.scale, args.repeat,
+                            {"stream": args.stream, "compact_model": args.compact_model}, args.verbose)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if args.startup:
+            slower = compare_startup(results, baseline, args.fail_over)
+        else:
+            slower = compare(results, baseline, args.fail_over)
+        if slower:
+            print >> sys.stderr, "slower than the baseline: %s" % ", ".join(slower)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
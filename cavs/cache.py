@@ -0,0 +1,184 @@
+"""Content addressed cache of converted vector sets.
+
+Re-running a validation often means converting vector sets that were already
+converted.  The legacy files of a conversion are kept here under a digest of the
+input vector set and CONVERTER_VERSION; a later conversion of the same input copies
+them into the output directory instead of converting again.  With link set, they are
+hard linked instead, which is faster but shares the files between the cache and the
+outputs: editing an output file in place then changes the cache entry too.
+
+Layout: one directory per entry, <cache_dir>/<digest[:2]>/<digest>/, holding the
+legacy files and ENTRY_FILENAME which lists them.  The mtime of the entry directory
+is its last use; once the cache grows over max_bytes the least recently used
+entries are evicted.
+
+Cached files keep the "Generated on" time of the conversion which produced them.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import emit
+import model
+from cavsalg import CONVERTER_VERSION
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+ENTRY_FILENAME = ".entry.json"
+
+
+def vector_set_digest(j, extra=""):
+    """Digest of a parsed vector set ([header, vectorSet]), independent of key order.
+    A streamed testGroups generator is consumed and replaced by a list."""
+    vectors = j[1]
+    if not isinstance(vectors.get('testGroups'), (list, type(None))):
+        vectors['testGroups'] = list(vectors['testGroups'])
+    h = hashlib.sha256()
+    h.update("%s\0%s\0" % (CONVERTER_VERSION, extra))
+    h.update(json.dumps(model.to_plain(j), sort_keys=True, separators=(',', ':')))
+    return h.hexdigest()
+
+
+def file_digest(path, extra="", chunk_size=1024 * 1024):
+    """Digest of a vector set file as stored, without parsing it."""
+    h = hashlib.sha256()
+    h.update("%s\0%s\0" % (CONVERTER_VERSION, extra))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _link_or_copy(src, dst, link):
+    """Put src at dst atomically, as a hard link when possible."""
+    if link:
+        directory, name = os.path.split(dst)
+        tmp = tempfile.mktemp(prefix='.%s.' % name, suffix='.tmp', dir=directory or '.')
+        try:
+            os.link(src, tmp)
+        except (OSError, AttributeError):
+            # Other file system, or no hard links here
+            pass
+        else:
+            os.rename(tmp, dst)
+            return
+    with open(src, 'rb') as f:
+        with emit.AtomicFile(dst) as output:
+            shutil.copyfileobj(f, output)
+
+
+class ConversionCache(object):
+    """Cache of legacy files in cache_dir, at most max_bytes (roughly) in size.
+    hits, misses, stores and evictions count what happened through this instance."""
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, link=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+
+    def key_for(self, j, extra=""):
+        return vector_set_digest(j, extra)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _read_entry(self, entry_dir):
+        with open(os.path.join(entry_dir, ENTRY_FILENAME)) as f:
+            return json.load(f)
+
+    def fetch(self, key, out):
+        """Write the cached legacy files for key through out (a directory or a writer
+        from the emit module) and return their names, or None on a miss."""
+        entry_dir = self._entry_dir(key)
+        try:
+            entry = self._read_entry(entry_dir)
+            writer = emit.writer_for(out)
+            for filename in entry["files"]:
+                src = os.path.join(entry_dir, filename)
+                if isinstance(writer, emit.DirectoryWriter):
+                    _link_or_copy(src, os.path.join(writer.out_dir, filename), self.link)
+                else:
+                    with open(src, 'rb') as f:
+                        writer.write(filename, iter(lambda: f.read(emit.DEFAULT_BUFFER_SIZE), ''))
+            os.utime(entry_dir, None)
+        except (IOError, OSError, ValueError, KeyError):
+            # Not there, or evicted by another process while we were at it
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["files"]
+
+    def store(self, key, out_dir, filenames):
+        """Add the legacy files just written into out_dir under key, then evict least
+        recently used entries to get back under max_bytes."""
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        shard = os.path.dirname(entry_dir)
+        try:
+            os.makedirs(shard)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+        tmp = tempfile.mkdtemp(prefix='.%s.' % key, dir=shard)
+        try:
+            size = 0
+            for filename in filenames:
+                dst = os.path.join(tmp, filename)
+                _link_or_copy(os.path.join(out_dir, filename), dst, self.link)
+                size += os.path.getsize(dst)
+            with open(os.path.join(tmp, ENTRY_FILENAME), 'wt') as f:
+                json.dump({"files": list(filenames), "bytes": size, "version": CONVERTER_VERSION}, f)
+            os.rename(tmp, entry_dir)
+        except OSError:
+            # Somebody else stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+            return
+        self.stores += 1
+        self.evict()
+
+    def entries(self):
+        """(last use, bytes, entry directory) of every entry, least recently used first."""
+        res = []
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for key in os.listdir(shard_dir):
+                entry_dir = os.path.join(shard_dir, key)
+                if key.startswith('.'):
+                    continue
+                try:
+                    res.append((os.stat(entry_dir).st_mtime, self._read_entry(entry_dir)["bytes"], entry_dir))
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+        res.sort()
+        return res
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for mtime, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
@@ -1,9 +1,88 @@
 import time
+import errno
 import json
-import sys
 import os
+import hashlib
 
-from pdb import set_trace as bp
+import acvpjson
+import emit
+import instrument
+import model
+from plan import ConversionPlan
+
+# parallel (multiprocessing) and pipeline are only imported by the conversions using them.
+
+# Bump whenever a change alters the generated legacy files; conversion caches are keyed on it.
+CONVERTER_VERSION = "1"
+
+# Environment variable which makes the converter mains (python cavs/aes.py out < vs.json)
+# reattach stdin to /dev/tty once the vector set is read, for pdb
+DEBUG_TTY = "CAVS_DEBUG_TTY"
+
+
+def lower_column(tests, field):
+    """Lower-case one hex field across a list of test cases with a single call.
+    Test cases without the field give None."""
+    if tests and isinstance(tests[0], model.TestCase):
+        return model.hex_column(tests, field)
+    values = [tc.get(field) for tc in tests]
+    if None in values:
+        return [v.lower() if v is not None else None for v in values]
+    return "\n".join(values).lower().split("\n")
+
+
+# Value types legacy_group_stub keeps
+_SCALARS = (basestring, int, long, float, bool, type(None))
+
+
+def _measured(chunks, size):
+    """Pass chunks through, adding up their length in size[0]."""
+    for chunk in chunks:
+        size[0] += len(chunk)
+        yield chunk
+
+
+def expected_column(tests, field, test=None):
+    """lower_column of an expected result across tests, which must all have it.
+    test is the test case tests are the monte carlo iterations of, if they are."""
+    values = lower_column(tests, field)
+    for tc, v in zip(tests, values):
+        if v is None:
+            raise ValueError("Test case %s has no expected %s; the vector set does not carry the answers"
+                             % ((test or tc)['tcId'], field))
+    return values
+
+
+def expected_results(test):
+    """The monte carlo iterations (resultsArray) expected of test."""
+    results = test.get('resultsArray')
+    if not results:
+        raise ValueError("Test case %s has no expected resultsArray; the vector set does not carry the answers"
+                         % test['tcId'])
+    return results
+
+
+def _measured_pairs(pairs, size):
+    """_measured for (chunk, answer chunk) pairs, adding up both."""
+    for chunk, answer in pairs:
+        size[0] += len(chunk) + len(answer)
+        yield chunk, answer
+
+
+def criteria_match(tg, criteria):
+    """Whether test group tg meets every criterion (the criteria_dict of findAll: key
+    names prefixed by '!' invert the comparison, callable values are called with the
+    group's value).  A group without one of the keys does not match."""
+    for k, v in criteria.iteritems():
+        invert = k.startswith("!")
+        if invert:
+            k = k[1:]
+        if k not in tg:
+            return False
+        hit = bool(v(tg[k])) if callable(v) else v == tg[k]
+        if hit == invert:
+            return False
+    return True
 
 
 class DottedDict(dict):
@@ -14,6 +93,17 @@ class DottedDict(dict):
 
 
 class CAVSAlgorithm(object):
+    # Composite indexes (tuples of test group keys) to build in legacy_preprocess
+    # on top of the testType/_testSubType ones.
+    _composite_indexes = ()
+    # Decorations detect_test_sub_type adds to test cases, which parallel classification
+    # has to copy back from the workers.
+    _test_case_decorations = ()
+    # Answer files to_cavs(answers=True) writes next to every .req file: the response
+    # and the fax file CAVS hands out with the expected results, which for the
+    # algorithms here are the .req records with the answers filled in.
+    legacy_answer_extensions = ('.rsp', '.fax')
+
     def __init__(self, algorithm):
         self._json = None
         self._meta = {"algorithm":algorithm}
@@ -21,6 +111,11 @@ class CAVSAlgorithm(object):
         self._vectors = None
         self._header = None
         self._indexes = {}
+        self._selection = None
+        self._workers = 1
+        self._chunk_groups = None
+        self.written_files = []
+        self.removed_files = []
 
     def __getattr__(self, k):
         if k in self._vectors:
@@ -55,7 +150,7 @@ class CAVSAlgorithm(object):
                         if v == tg[k] and (not invert):
                             match += 1
                 except Exception as ex:
-                    print >> sys.stderr, ex
+                    instrument.event("findall_error", algorithm=self._meta["algorithm"], error="%s: %s" % (ex.__class__.__name__, ex))
                     continue
 
             # All criteria have to match
@@ -75,28 +170,117 @@ class CAVSAlgorithm(object):
         return self._json
 
     def from_acvp(self, json_str):
-        self.json = json.loads(json_str)
+        with instrument.span("parse", algorithm=self._meta["algorithm"]):
+            self.json = json.loads(json_str)
+
+    def from_acvp_stream(self, stream):
+        """Load the vector set incrementally; testGroups becomes a generator that is
+        consumed by legacy_preprocess."""
+        with instrument.span("parse", algorithm=self._meta["algorithm"]):
+            self.json = acvpjson.load(stream)
+
+    def use_model(self):
+        """Convert the test groups to the compact model (see model.py) as they are consumed."""
+        self._vectors['testGroups'] = model.load_groups(self._vectors['testGroups'])
+
+    def use_workers(self, workers, chunk_groups=None):
+        """Classify and render the test groups on workers processes (see parallel.py),
+        handing out chunk_groups groups at a time for classification.  The output is
+        the same as with a single process.  A streamed vector set is read in full first."""
+        self._workers = workers or 1
+        self._chunk_groups = chunk_groups
+
+    def select(self, criteria):
+        """Only convert the test groups meeting criteria (see criteria_match), checked
+        once they are classified so decorations such as _testSubType may be used.
+        None selects everything again.  Takes effect in legacy_preprocess."""
+        self._selection = criteria
 
     def _add_to_index(self, index, tg):
+        """Index is either a single key name or a tuple of key names (a composite index).
+        Entries keep the order in which they were added."""
+        if isinstance(index, tuple):
+            value = tuple([tg[k] for k in index])
+        else:
+            value = tg[index]
         if index not in self._indexes:
             self._indexes[index] = {}
-        if tg[index] not in self._indexes[index]:
-            self._indexes[index][tg[index]] = []
-        self._indexes[index][tg[index]].append(tg)
+        if value not in self._indexes[index]:
+            self._indexes[index][value] = []
+        self._indexes[index][value].append(tg)
+
+    def find_indexed(self, index, value):
+        """Dictionary lookup counterpart of findAll for the indexes built by legacy_preprocess.
+        For a composite index, value is the tuple of key values in index order."""
+        return self._indexes.get(index, {}).get(value, [])
 
 
     def legacy_preprocess(self):
         """Tag the existing ACV tree with decorators that we can use for traversal
         when dealing with the legacy output format.
         """
-        for tg in self.testGroups:
-            tg['_testSubType'] = self.detect_test_sub_type(tg)
-            self._add_to_index('testType', tg)
-            self._add_to_index('_testSubType', tg)
+        measure = instrument.enabled()
+        if measure:
+            algorithm = self._vectors.get('algorithm')
+            start = time.time()
+            classify = 0.0
+            outcomes = {}
+            tests = 0
+
+        # testGroups may be a generator when the vector set is streamed in; keep the groups
+        # we have seen since the legacy file grouping needs to revisit them.
+        testGroups = []
+        # The indexes are those of this conversion only.  Both are present even when
+        # select() leaves nothing, so the plan comes out empty.
+        self._indexes = {'testType': {}, '_testSubType': {}}
+        groups = self.testGroups
+        subTypes = None
+        if self._workers > 1:
+            groups = list(groups)
+            t = time.time()
+            import parallel
+            subTypes = iter(parallel.classify(self, groups, self._workers, self._chunk_groups))
+            if measure:
+                classify += time.time() - t
+        for tg in groups:
+            if subTypes is not None:
+                tg['_testSubType'] = subTypes.next()
+            elif measure:
+                t = time.time()
+                tg['_testSubType'] = self.detect_test_sub_type(tg)
+                classify += time.time() - t
+            else:
+                tg['_testSubType'] = self.detect_test_sub_type(tg)
+            if measure:
+                outcomes[tg['_testSubType']] = outcomes.get(tg['_testSubType'], 0) + 1
+                tests += len(tg['tests'])
+                instrument.event("classified", algorithm=algorithm, tgId=tg['tgId'], subType=tg['_testSubType'])
+            if self._selection is not None and not criteria_match(tg, self._selection):
+                continue
+            self.legacy_index_group(tg)
+            testGroups.append(tg)
+        self._vectors['testGroups'] = testGroups
+
+        if measure:
+            instrument.observe("preprocess", time.time() - start, algorithm=algorithm)
+            instrument.observe("classify", classify, algorithm=algorithm)
+            instrument.count("groups", len(testGroups), algorithm=algorithm)
+            instrument.count("test_cases", tests, algorithm=algorithm)
+            for subType, n in sorted(outcomes.iteritems()):
+                instrument.count("classified_groups", n, algorithm=algorithm, subType=subType)
 
     def detect_test_sub_type(self, tg):
         pass
 
+    def legacy_index_group(self, tg):
+        """Add a classified test group to the indexes legacy_file_groups works from.
+        Subclasses indexing test cases as well do it here, so groups left out by
+        select() stay out of every index."""
+        self._add_to_index('testType', tg)
+        self._add_to_index('_testSubType', tg)
+        for index in self._composite_indexes:
+            self._add_to_index(index, tg)
+
     def legacy_group_by(self):
         raise NotImplementedError("Not implemented in %s" % self.__class__.__name__)
 
@@ -118,21 +302,255 @@ class CAVSAlgorithm(object):
     def generate_legacy_test_case_record(self, test_case):
         raise NotImplementedError("Not implemented in %s" % self.__class__.__name__)
 
-    def to_cavs(self, out_dir):
+    def legacy_response_fields(self, group, test, record):
+        """Map a record from a legacy response file (a dict of name to value) answering
+        test back to the ACVP response fields.  None means the record holds no answer."""
+        raise NotImplementedError("Not implemented in %s" % self.__class__.__name__)
+
+    def legacy_response_expected(self, group, test, expected):
+        """The expected results for test (a test case of an expected results file) as far as
+        a legacy response can carry them, for checking responses against (see verify.py)."""
+        return expected
+
+    def legacy_response_starts_test(self, group, record):
+        """Monte carlo responses carry many records per test case; tell whether this
+        record is the first one of the next test case."""
+        return record.get('COUNT') == '0'
+
+    def render_legacy_test_group(self, group, tests=None):
+        """Render the records of every test case in group (or of the given subset of its
+        test cases) in one call.  Subclasses override this to work out the per-group
+        constants once instead of for every record."""
+        tests = group["tests"] if tests is None else tests
+        return [self.generate_legacy_test_case_record(group, test) for test in tests]
+
+    def legacy_plan(self):
+        """Preprocess the vector set and return the ConversionPlan listing every legacy file once."""
         # This bit will introduce meta data to help re-split the test data like old legacy
         self.legacy_preprocess()
+        with instrument.span("plan", algorithm=self._vectors.get('algorithm')):
+            return ConversionPlan.from_file_groups(self.legacy_file_groups())
+
+    def render_legacy_file(self, file_groups, py_timestamp, group_chunks=None):
+        """Yield the text of one legacy file (an entry of the plan) in chunks.
+        group_chunks stands in for render_legacy_test_group_chunks (parallel.GroupRenderer)."""
+        group_chunks = group_chunks or self.render_legacy_test_group_chunks
+        yield self.generate_legacy_header(file_groups["testGroups"], py_timestamp) + "\n"
+
+        for test_group in file_groups["testGroups"]:
+            yield "\n" + self.generate_legacy_group_record(test_group) + "\n"
+
+            for chunk in group_chunks(test_group):
+                yield chunk
+
+    def render_legacy_test_group_chunks(self, group):
+        """The records of a test group as text chunks, each record surrounded by newlines.
+        Subclasses with records too large to hold in memory (SHA LDT) render them here
+        piece by piece instead of through render_legacy_test_group."""
+        for record in self.render_legacy_test_group(group):
+            yield "\n" + record + "\n"
+
+    def legacy_answer_records(self, group, tests, records):
+        """The records of tests in an answer file (.rsp/.fax), given their .req records:
+        the exact inverse of what legacy_response_fields reads.  Raises ValueError when
+        the vector set does not carry the expected results (see expected_column)."""
+        raise NotImplementedError("Not implemented in %s" % self.__class__.__name__)
+
+    def render_legacy_answer_chunks(self, group):
+        """(.req chunk, answer chunk) pairs of a test group: the chunks of
+        render_legacy_test_group_chunks alongside those of the same records in the
+        answer files, so both come out of one pass over the test cases."""
+        tests = group["tests"]
+        records = self.render_legacy_test_group(group, tests)
+        for record, answer in zip(records, self.legacy_answer_records(group, tests, records)):
+            yield "\n" + record + "\n", "\n" + answer + "\n"
+
+    def render_legacy_answer_file(self, file_groups, py_timestamp):
+        """render_legacy_file, yielding (.req chunk, answer chunk) pairs."""
+        header = self.generate_legacy_header(file_groups["testGroups"], py_timestamp) + "\n"
+        yield header, header
 
-        for file_groups in self.legacy_file_groups():
-            with open(os.path.join(out_dir, file_groups["filename"]), "wt") as output:
-                print >> output, self.generate_legacy_header(file_groups["testGroups"], time.time())
+        for test_group in file_groups["testGroups"]:
+            record = "\n" + self.generate_legacy_group_record(test_group) + "\n"
+            yield record, record
 
-                for test_group in file_groups["testGroups"]:
-                    print >> output, ""
-                    print >> output, self.generate_legacy_group_record(test_group)
+            for pair in self.render_legacy_answer_chunks(test_group):
+                yield pair
 
-                    for test_case in test_group["tests"]:
-                        print >> output, ""
-                        print >> output, self.generate_legacy_test_case_record(test_group, test_case)
+    def legacy_answer_filenames(self, filename):
+        """The answer files which go with the legacy file filename."""
+        base = os.path.splitext(filename)[0]
+        return [base + ext for ext in self.legacy_answer_extensions]
 
+    def legacy_group_stub(self, group):
+        """What a pipelined conversion (pipeline.py) keeps of a test group once its records
+        are written: enough for generate_legacy_header and legacy_file_groups.  By
+        default its scalar keys; test cases and anything cached on the group (the AES
+        field profiles) would keep all of it alive."""
+        stub = dict((k, v) for k, v in group.iteritems() if isinstance(v, _SCALARS))
+        stub['tests'] = []
+        return stub
 
+    def legacy_group_fits_in_memory(self, group):
+        """Whether the records of group may be rendered in one piece, as the workers
+        of use_workers() do."""
+        return True
 
+    def legacy_file_hash(self, file_groups):
+        """Digest of everything a legacy file is rendered from: the converter, the
+        algorithm, the filename and its member test groups (without decorations)."""
+        h = hashlib.sha256()
+        h.update("%s\0%s\0%s\0%s\0" % (CONVERTER_VERSION, self._vectors.get('algorithm'),
+                                          self._vectors.get('mode'), file_groups["filename"]))
+        h.update(json.dumps(model.to_plain(file_groups["testGroups"]), sort_keys=True, separators=(',', ':')))
+        return h.hexdigest()
+
+    def to_cavs(self, out_dir, plan=None, buffer_size=emit.DEFAULT_BUFFER_SIZE, cache=None, cache_key=None,
+                incremental=False, pipeline=False, answers=False):
+        """Write the legacy files into out_dir and return the list of filenames written.
+        out_dir may also be a writer from the emit module.
+        A plan from legacy_plan() may be passed in to reuse it; otherwise one is built.
+        With a ConversionCache (cache.py), files converted before from the same vector set,
+        selection (select()) and plan are reused; cache_key overrides the digest of those
+        (see cache.file_digest), and then has to tell them apart itself.
+        With incremental set, only the files whose inputs changed since the last incremental
+        conversion into out_dir (a directory) are rendered and rewritten.
+        Either way, written_files lists the files actually (re)written, and removed_files
+        those of an earlier incremental conversion which are no longer planned; they are
+        deleted.
+        With pipeline set, the test groups are converted one at a time (see pipeline.py)
+        and released as they go; there is no plan to pass in then, nor incremental
+        conversion, and the test groups are left as stubs.
+        With answers set, every .req file comes with its answer files (.rsp and .fax,
+        see legacy_answer_extensions) holding the expected results the vector set
+        carries; all of them are written in the same pass over the test groups.
+        An out_dir of "-" or ending in .tar, .tar.gz, .tgz or .zip is an archive (see
+        emit.writer_for), which is complete when to_cavs returns."""
+        if pipeline and (plan is not None or incremental):
+            raise ValueError("A pipelined conversion takes neither a plan nor incremental")
+        if answers and (pipeline or incremental):
+            raise ValueError("Answer files are not written by pipelined or incremental conversions")
+        writer = emit.writer_for(out_dir, buffer_size)
+        if writer is out_dir:
+            return self._write_legacy_files(writer, plan, cache, cache_key, incremental, pipeline, answers)
+
+        # We opened the writer, so we finish it; an archive is only kept if complete
+        try:
+            filenames = self._write_legacy_files(writer, plan, cache, cache_key, incremental, pipeline, answers)
+        except:
+            writer.abort()
+            raise
+        writer.close()
+        return filenames
+
+    def _write_legacy_files(self, writer, plan, cache, cache_key, incremental, pipelined, answers):
+        incremental = incremental and isinstance(writer, emit.DirectoryWriter)
+        self.removed_files = []
+
+        if cache is not None and cache_key is None:
+            try:
+                cache_key = cache.key_for(self.json, self._cache_extra(plan, answers))
+            except TypeError:
+                # A selection made with callables; there is nothing to key it on
+                cache = None
+        if cache is not None:
+            filenames = cache.fetch(cache_key, writer)
+            instrument.count("cache_lookups", algorithm=self._vectors.get('algorithm'), result="miss" if filenames is None else "hit")
+            if filenames is not None:
+                if isinstance(writer, emit.DirectoryWriter):
+                    emit.Manifest.discard(writer.out_dir)
+                self.written_files = filenames
+                return filenames
+
+        if pipelined:
+            import pipeline
+            plan = pipeline.convert(self, writer, writer.buffer_size)
+            if isinstance(writer, emit.DirectoryWriter):
+                emit.Manifest.discard(writer.out_dir)
+            if cache is not None and isinstance(writer, emit.DirectoryWriter):
+                cache.store(cache_key, writer.out_dir, plan.filenames())
+            return plan.filenames()
+
+        if plan is None:
+            plan = self.legacy_plan()
+
+        manifest = emit.Manifest.load(writer.out_dir) if incremental else None
+        # Answer files are rendered here, alongside the .req records
+        renderer = None
+        if self._workers > 1 and not answers:
+            import parallel
+            renderer = parallel.GroupRenderer(self, plan, self._workers)
+        try:
+            self._write_planned(writer, plan, manifest, renderer, answers)
+        except:
+            if renderer is not None:
+                renderer.abort()
+            raise
+        if renderer is not None:
+            renderer.close()
+
+        if manifest is not None:
+            # Files which are no longer planned were written by an earlier run; they go
+            for filename in sorted(set(manifest.hashes) - set(plan.filenames())):
+                del manifest.hashes[filename]
+                try:
+                    os.unlink(os.path.join(writer.out_dir, filename))
+                except OSError as ex:
+                    if ex.errno != errno.ENOENT:
+                        raise
+                self.removed_files.append(filename)
+                instrument.event("removed", algorithm=self._vectors.get('algorithm'), filename=filename)
+            manifest.save()
+        elif isinstance(writer, emit.DirectoryWriter):
+            emit.Manifest.discard(writer.out_dir)
+
+        filenames = plan.filenames()
+        if answers:
+            filenames = [f for filename in filenames for f in [filename] + self.legacy_answer_filenames(filename)]
+        if cache is not None and isinstance(writer, emit.DirectoryWriter):
+            cache.store(cache_key, writer.out_dir, filenames)
+        return filenames
+
+    def _cache_extra(self, plan, answers):
+        """What the files written depend on besides the vector set, for the cache key: the
+        answers, the selection and a plan passed in (its files and their test groups)."""
+        extra = ["answers" if answers else ""]
+        if self._selection is not None:
+            extra.append(json.dumps(self._selection, sort_keys=True))
+        if plan is not None:
+            extra.append(json.dumps(plan.to_json(), sort_keys=True))
+        return "\0".join(extra)
+
+    def _write_planned(self, writer, plan, manifest, renderer, answers=False):
+        measure = instrument.enabled()
+        algorithm = self._vectors.get('algorithm')
+        self.written_files = []
+        for file_groups in plan:
+            filename = file_groups["filename"]
+            if manifest is not None:
+                digest = self.legacy_file_hash(file_groups)
+                if manifest.up_to_date(filename, digest):
+                    continue
+                manifest.hashes[filename] = digest
+            filenames = [filename]
+            if answers:
+                filenames += self.legacy_answer_filenames(filename)
+                chunks = self.render_legacy_answer_file(file_groups, time.time())
+                write = lambda chunks: emit.write_answers(writer, filenames, chunks)
+                measured = _measured_pairs
+            else:
+                group_chunks = renderer.group_chunks(filename) if renderer is not None else None
+                chunks = self.render_legacy_file(file_groups, time.time(), group_chunks)
+                write = lambda chunks: writer.write(filename, chunks)
+                measured = _measured
+            if measure:
+                # Rendering is lazy, so this times rendering and writing together
+                size = [0]
+                with instrument.span("emit", algorithm=algorithm):
+                    write(measured(chunks, size))
+                instrument.count("files_written", len(filenames), algorithm=algorithm)
+                instrument.count("bytes_written", size[0], algorithm=algorithm)
+                instrument.event("file_written", algorithm=algorithm, file=filename, bytes=size[0])
+            else:
+                write(chunks)
+            self.written_files.extend(filenames)
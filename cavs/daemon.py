@@ -0,0 +1,595 @@
+"""Conversion daemon: keeps the converters loaded and takes jobs over a Unix socket.
+
+For a small vector set, starting an interpreter and importing the converters costs
+far more than the conversion itself.  The daemon pays for that once; its worker
+processes are forked after the imports, so a job only costs the conversion.
+
+    python cavs/daemon.py serve --socket /tmp/cavs.sock -j 4 [--http 8080]
+    python cavs/daemon.py submit --socket /tmp/cavs.sock ACVP-AES-CBC.json out/ --wait
+    python cavs/daemon.py status --socket /tmp/cavs.sock [job-id]
+    python cavs/daemon.py shutdown --socket /tmp/cavs.sock
+
+The protocol is one JSON object per line each way:
+
+    {"op": "submit", "path": "/abs/ACVP-AES-CBC.json", "out": "/abs/out/", "options": {...}}
+    {"op": "submit", "json": [header, vectorSet], "out": "/abs/out.tar.gz", "wait": true}
+    {"op": "status", "id": 3}           (without an id, every job the daemon remembers)
+    {"op": "wait", "id": 3}
+    {"op": "shutdown"}
+
+Every reply has "ok", and "error" when it is false.  out is a directory or an archive
+name (see emit.writer_for); options are those of batch.convert_file listed in
+JOB_OPTIONS.  Paths are taken as they are, so clients should send absolute ones.
+When the job queue is full, submissions are refused rather than blocking the daemon.
+
+With --http, the same is served on localhost: POST /jobs with the submit object as
+body, GET /jobs, GET /jobs/<id> (?wait=1 to wait for it) and POST /shutdown.  Every
+HTTP request needs "Authorization: Bearer <token>", the token being in
+<socket>.token, which only the owner can read; it stands in for the permissions of the
+Unix socket.  POST bodies must be sent as application/json.  Both keep out other local
+users and the simple cross-origin requests web pages can make.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import BaseHTTPServer
+import Queue
+import SocketServer
+import urlparse
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import acvpjson
+import batch
+import cache
+import emit
+import instrument
+import registry
+
+DEFAULT_QUEUE_SIZE = 64
+
+# Finished jobs remembered for status requests; the oldest are forgotten first
+MAX_FINISHED = 1000
+
+# batch.convert_file options a job may set
+JOB_OPTIONS = ("dump_plan", "buffer_size", "compact_model", "cache_dir", "cache_max_bytes", "cache_link", "incremental", "pipeline", "answers")
+
+
+def convert_job(spec, metrics=False):
+    """Run a job (the submit request); never raises.  With metrics, what was measured
+    comes back as "events", as in batch.convert_file."""
+    if not metrics:
+        return _convert_job(spec)
+    with instrument.capture() as recorder:
+        result = _convert_job(spec)
+    result["events"] = recorder.events
+    return result
+
+
+def _convert_job(spec):
+    opts = dict(batch.DEFAULT_OPTIONS)
+    opts.update(spec.get("options") or {})
+    result = {"ok": False, "algorithm": None, "files": [], "written": 0, "error": None, "cache": None}
+    start = time.time()
+    try:
+        out = spec["out"]
+        if not emit.archive_format(out) and not os.path.isdir(out):
+            os.makedirs(out)
+        c = None
+        if opts["cache_dir"]:
+            c = cache.ConversionCache(opts["cache_dir"], opts["cache_max_bytes"], opts["cache_link"])
+        if "path" in spec and c is not None and _cached(c, spec["path"], out, opts, result):
+            result["ok"] = True
+            result["seconds"] = time.time() - start
+            instrument.count("vector_sets", result="cached")
+            return result
+        if "path" in spec:
+            with open(spec["path"]) as f:
+                with instrument.span("parse"):
+                    j = acvpjson.load(f)
+                _convert(j, out, opts, spec["path"], result, c)
+        else:
+            _convert(spec["json"], out, opts, None, result, c)
+        result["ok"] = True
+    except Exception as ex:
+        result["error"] = "%s: %s" % (ex.__class__.__name__, ex)
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.time() - start
+    instrument.observe("convert", result["seconds"], algorithm=result["algorithm"])
+    instrument.count("vector_sets", result="converted" if result["ok"] else "failed")
+    return result
+
+
+def _cache_key(path, opts):
+    # Same key as batch.py for files, so both share the cache
+    return cache.file_digest(path, batch.cache_extra(opts))
+
+
+def _cached(c, path, out, opts, result):
+    """Serve a job for the vector set file at path from the cache c, as batch.py does:
+    the file is only hashed, not decoded.  False on a miss."""
+    writer = emit.writer_for(out)
+    files = c.fetch(_cache_key(path, opts), writer)
+    result["cache"] = c.stats()
+    if files is None:
+        writer.abort()
+        return False
+    writer.close()
+    if isinstance(writer, emit.DirectoryWriter):
+        emit.Manifest.discard(out)
+    result["files"] = [f for f in files if f != batch.PLAN_FILENAME]
+    result["written"] = len(result["files"])
+    return True
+
+
+def _convert(j, out, opts, path, result, c=None):
+    result["algorithm"] = j[1].get('algorithm')
+    a = registry.for_json(j)
+    if opts["compact_model"]:
+        a.use_model()
+    plan = None
+    if not opts["pipeline"]:
+        plan = a.legacy_plan()
+        if opts["dump_plan"] and os.path.isdir(out):
+            with open(os.path.join(out, batch.PLAN_FILENAME), "wt") as p:
+                plan.dump(p)
+
+    # Files were looked up before they were decoded (_cached) and are only stored here;
+    # inline vector sets go through the cache of to_cavs, keyed on their contents
+    result["files"] = a.to_cavs(out, plan, opts["buffer_size"], cache=c if path is None else None,
+                                incremental=opts["incremental"], pipeline=opts["pipeline"], answers=opts["answers"])
+    result["written"] = len(a.written_files)
+    result["removed"] = a.removed_files
+    if c is not None:
+        if path is not None and os.path.isdir(out):
+            c.store(_cache_key(path, opts), out, result["files"] + ([batch.PLAN_FILENAME] if opts["dump_plan"] else []))
+        result["cache"] = c.stats()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job(object):
+    """A submitted job; state goes queued, running, then done or failed."""
+    def __init__(self, id, spec):
+        self.id = id
+        self.spec = spec
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = self.finished = None
+        self.result = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def finish(self, result):
+        self.result = result
+        self.state = "done" if result["ok"] else "failed"
+        self.finished = time.time()
+        self._done.set()
+
+    def to_json(self):
+        res = {"id": self.id, "state": self.state, "submitted": self.submitted,
+               "started": self.started, "finished": self.finished, "result": self.result}
+        if "path" in self.spec:
+            res["path"] = self.spec["path"]
+        res["out"] = self.spec["out"]
+        return res
+
+
+def check_spec(spec):
+    """Complain (ValueError) about a submit request which cannot be run."""
+    if ("path" in spec) == ("json" in spec):
+        raise ValueError("a job needs either a path or an inline json vector set")
+    out = spec.get("out")
+    if not isinstance(out, basestring) or not out or out == "-":
+        raise ValueError("a job needs an output directory or archive name as out")
+    if "json" in spec:
+        j = spec["json"]
+        if not (isinstance(j, list) and len(j) == 2 and isinstance(j[1], dict)):
+            raise ValueError("an inline vector set must be [header, vectorSet]")
+    unknown = set(spec.get("options") or {}) - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError("unknown option(s) %s" % ", ".join(sorted(unknown)))
+
+
+class ConversionService(object):
+    """Bounded job queue in front of the workers.
+
+    workers jobs run at a time, each in a process of a pool forked when the service
+    starts; with threads set they run in this process instead (no pickling, but only
+    one converts at a time under the GIL).  Up to queue_size more may wait.
+    """
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE, threads=False, metrics=False):
+        self.workers = workers or cpu_count()
+        self.threads = threads
+        self.metrics = metrics and not threads
+        self._queue = Queue.Queue(queue_size)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._pool = None
+        self._dispatchers = []
+
+    def start(self):
+        # Fork before any thread exists, and before the socket is bound; the converters
+        # are imported first so the workers share them
+        registry.load_all()
+        if not self.threads:
+            self._pool = Pool(self.workers)
+        for _ in xrange(self.workers):
+            t = threading.Thread(target=self._dispatch)
+            t.daemon = True
+            t.start()
+            self._dispatchers.append(t)
+
+    def stop(self):
+        """Let the queued jobs finish, then stop the workers."""
+        for _ in self._dispatchers:
+            self._queue.put(None)
+        for t in self._dispatchers:
+            t.join()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+    def _dispatch(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.state = "running"
+            job.started = time.time()
+            if self._pool is not None:
+                result = self._pool.apply(convert_job, (job.spec, self.metrics))
+            else:
+                result = convert_job(job.spec)
+            with self._lock:
+                instrument.replay(result.pop("events", []))
+                job.finish(result)
+                self._forget()
+
+    def _forget(self):
+        finished = [id for id, job in self._jobs.iteritems() if job.finished is not None]
+        for id in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self._jobs[id]
+
+    def submit(self, spec):
+        check_spec(spec)
+        with self._lock:
+            job = Job(self._next_id, spec)
+            try:
+                self._queue.put_nowait(job)
+            except Queue.Full:
+                raise QueueFull("job queue full (%d queued)" % self._queue.maxsize)
+            self._next_id += 1
+            self._jobs[job.id] = job
+        return job
+
+    def job(self, id):
+        with self._lock:
+            job = self._jobs.get(id)
+        if job is None:
+            raise KeyError("no job %s" % id)
+        return job
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.itervalues())
+
+    def handle(self, req):
+        """Answer one protocol request (a dict); never raises."""
+        try:
+            op = req.get("op")
+            if op == "submit":
+                spec = dict((k, v) for k, v in req.iteritems() if k not in ("op", "wait"))
+                job = self.submit(spec)
+                if req.get("wait"):
+                    job.wait()
+                return {"ok": True, "job": job.to_json()}
+            elif op == "status" and req.get("id") is not None:
+                return {"ok": True, "job": self.job(req["id"]).to_json()}
+            elif op == "status":
+                return {"ok": True, "jobs": [job.to_json() for job in self.jobs()],
+                        "queued": self._queue.qsize(), "workers": self.workers}
+            elif op == "wait":
+                job = self.job(req.get("id"))
+                job.wait(req.get("timeout"))
+                return {"ok": True, "job": job.to_json()}
+            elif op == "shutdown":
+                # Replied to before the server goes; see serve()
+                return {"ok": True, "shutdown": True}
+            return {"ok": False, "error": "unknown op %r" % op}
+        except (ValueError, KeyError, QueueFull) as ex:
+            return {"ok": False, "error": str(ex).strip("'")}
+
+
+class _UnixHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line)
+            except ValueError as ex:
+                reply = {"ok": False, "error": "bad request: %s" % ex}
+            else:
+                reply = self.server.service.handle(req if isinstance(req, dict) else {})
+            self.wfile.write(json.dumps(reply) + "\n")
+            self.wfile.flush()
+            if reply.get("shutdown"):
+                self.server.stop_soon()
+                return
+
+
+# Appended to the socket path for the file holding the HTTP token
+TOKEN_SUFFIX = ".token"
+
+
+def _same_token(a, b):
+    """Compare tokens in a time which does not depend on where they differ."""
+    if len(a) != len(b):
+        return False
+    diff = 0
+    for x, y in zip(a, b):
+        diff |= ord(x) ^ ord(y)
+    return diff == 0
+
+
+class _HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def _authorized(self):
+        scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+        if scheme.lower() == "bearer" and _same_token(token.strip(), self.server.token):
+            return True
+        self._reply({"ok": False, "error": "unauthorized"}, 401)
+        return False
+    def _reply(self, reply, status=None):
+        body = json.dumps(reply)
+        if status is None:
+            status = 200 if reply["ok"] else (503 if "queue full" in reply.get("error", "") else 400)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urlparse.urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = urlparse.parse_qs(url.query)
+        service = self.server.service
+        if parts == ["jobs"]:
+            return self._reply(service.handle({"op": "status"}))
+        if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            op = "wait" if query.get("wait", ["0"])[0] not in ("0", "") else "status"
+            reply = service.handle({"op": op, "id": int(parts[1])})
+            return self._reply(reply, None if reply["ok"] else 404)
+        self._reply({"ok": False, "error": "not found"}, 404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if (self.headers.get("Content-Type") or "").split(";")[0].strip().lower() != "application/json":
+            return self._reply({"ok": False, "error": "request body must be application/json"}, 415)
+        path = urlparse.urlparse(self.path).path.rstrip("/")
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            req = json.loads(body) if body else {}
+        except ValueError as ex:
+            return self._reply({"ok": False, "error": "bad request: %s" % ex})
+        if path == "/jobs" and isinstance(req, dict):
+            req["op"] = "submit"
+            return self._reply(self.server.service.handle(req))
+        if path == "/shutdown":
+            self._reply({"ok": True, "shutdown": True})
+            return self.server.stop_soon()
+        self._reply({"ok": False, "error": "not found"}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(object):
+    """What both transports share: the service and a way to stop every server."""
+    def stop_soon(self):
+        # shutdown() waits for serve_forever, so it cannot run on a handler thread
+        threading.Thread(target=self.stop_all).start()
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer, _Server):
+    daemon_threads = True
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer, _Server):
+    daemon_threads = True
+
+
+def _bind_unix(path, service):
+    if os.path.exists(path):
+        # A socket left behind by a daemon which is gone can be replaced; a live one cannot
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(path)
+        except socket.error:
+            os.unlink(path)
+        else:
+            raise RuntimeError("a daemon is already listening on %s" % path)
+        finally:
+            s.close()
+    # Only the owner may submit jobs
+    umask = os.umask(0o077)
+    try:
+        server = UnixServer(path, _UnixHandler)
+    finally:
+        os.umask(umask)
+    server.service = service
+    return server
+
+
+def _write_token(path):
+    """A new random token in path, readable by the owner only."""
+    token = os.urandom(32).encode("hex")
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+    return token
+
+
+def serve(socket_path, workers=None, queue_size=DEFAULT_QUEUE_SIZE, threads=False, http_port=None, metrics=False):
+    """Run the daemon until a shutdown request; queued jobs are finished first."""
+    service = ConversionService(workers, queue_size, threads, metrics)
+    service.start()
+    servers = [_bind_unix(socket_path, service)]
+    token_path = None
+    if http_port is not None:
+        # Local clients only, and of those only the ones who can read the token
+        http = HTTPServer(("127.0.0.1", http_port), _HTTPHandler)
+        http.service = service
+        token_path = socket_path + TOKEN_SUFFIX
+        http.token = _write_token(token_path)
+        servers.append(http)
+
+    def stop_all():
+        for server in servers:
+            server.shutdown()
+    threads_ = []
+    for server in servers:
+        server.stop_all = stop_all
+        t = threading.Thread(target=server.serve_forever)
+        t.start()
+        threads_.append(t)
+    try:
+        # Joined with a timeout so KeyboardInterrupt gets through
+        while any(t.is_alive() for t in threads_):
+            for t in threads_:
+                t.join(0.5)
+    except KeyboardInterrupt:
+        stop_all()
+    finally:
+        for server in servers:
+            server.server_close()
+        os.unlink(socket_path)
+        if token_path is not None:
+            os.unlink(token_path)
+        service.stop()
+
+
+def request(socket_path, req, timeout=None):
+    """Send one request to the daemon at socket_path and return its reply."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(socket_path)
+        f = s.makefile("r+b")
+        f.write(json.dumps(req) + "\n")
+        f.flush()
+        line = f.readline()
+        f.close()
+    finally:
+        s.close()
+    if not line:
+        raise IOError("no reply from the daemon at %s" % socket_path)
+    return json.loads(line)
+
+
+def _print_job(job, stream=sys.stdout):
+    r = job["result"]
+    what = job.get("path") or "<inline>"
+    if r is None:
+        print >> stream, "%-6d %-8s %s -> %s" % (job["id"], job["state"], what, job["out"])
+    elif r["ok"]:
+        print >> stream, "%-6d %-8s %s -> %s (%s): %d file(s) in %.3fs" % (
+            job["id"], job["state"], what, job["out"], r["algorithm"] or "cached", len(r["files"]), r["seconds"])
+    else:
+        print >> stream, "%-6d %-8s %s -> %s: %s" % (job["id"], job["state"], what, job["out"], r["error"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the ACVP to CAVS converters loaded and convert vector sets on request.")
+    parser.add_argument("--socket", default="cavs.sock", help="Unix socket of the daemon (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("serve", help="run the daemon")
+    p.add_argument("-j", "--jobs", type=int, default=cpu_count(), help="jobs converted at a time (default: %(default)s)")
+    p.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="jobs which may wait; more are refused (default: %(default)s)")
+    p.add_argument("--threads", action="store_true", help="convert in the daemon process instead of a process pool")
+    p.add_argument("--http", type=int, metavar="PORT", help="also serve the jobs over HTTP on 127.0.0.1:PORT, to holders of the token in <socket>%s" % TOKEN_SUFFIX)
+    p.add_argument("--metrics-jsonl", metavar="PATH", help="append spans, counters and events to PATH as JSON lines")
+    p.add_argument("--metrics-textfile", metavar="PATH", help="write aggregated metrics to PATH in the Prometheus text format on exit")
+
+    p = sub.add_parser("submit", help="submit a vector set")
+    p.add_argument("vector_set", help="vector set file, or - to send it inline from stdin")
+    p.add_argument("out", help="output directory or archive")
+    p.add_argument("--wait", action="store_true", help="wait for the job and print how it went")
+    p.add_argument("--compact-model", action="store_true", help="hold test groups in the compact model")
+    p.add_argument("--incremental", action="store_true", help="only rewrite the files whose test groups changed")
+    p.add_argument("--answers", action="store_true", help="also write .rsp and .fax files with the expected results")
+    p.add_argument("--cache-dir", help="conversion cache directory (see batch.py)")
+    p.add_argument("--cache-link", action="store_true", help="hard link files from the cache instead of copying them (see batch.py)")
+
+    p = sub.add_parser("status", help="show one job, or all of them")
+    p.add_argument("id", type=int, nargs="?")
+
+    p = sub.add_parser("wait", help="wait for a job")
+    p.add_argument("id", type=int)
+
+    sub.add_parser("shutdown", help="finish the queued jobs and stop the daemon")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if args.threads and (args.metrics_jsonl or args.metrics_textfile):
+            parser.error("metrics are only collected with worker processes, not --threads")
+        if args.metrics_jsonl:
+            instrument.add_sink(instrument.JSONLinesSink(args.metrics_jsonl))
+        if args.metrics_textfile:
+            instrument.add_sink(instrument.PrometheusTextfileSink(args.metrics_textfile))
+        try:
+            serve(args.socket, args.jobs, args.queue_size, args.threads, args.http, instrument.enabled())
+        except RuntimeError as ex:
+            parser.error(str(ex))
+        finally:
+            instrument.close()
+        return 0
+
+    if args.command == "submit":
+        req = {"op": "submit", "out": os.path.abspath(args.out), "wait": args.wait, "options": {
+            "compact_model": args.compact_model, "incremental": args.incremental, "answers": args.answers,
+            "cache_dir": args.cache_dir and os.path.abspath(args.cache_dir), "cache_link": args.cache_link}}
+        if args.vector_set == "-":
+            req["json"] = json.load(sys.stdin)
+        else:
+            req["path"] = os.path.abspath(args.vector_set)
+    elif args.command in ("status", "wait"):
+        req = {"op": args.command, "id": args.id}
+    else:
+        req = {"op": args.command}
+
+    try:
+        reply = request(args.socket, req)
+    except (socket.error, IOError) as ex:
+        print >> sys.stderr, "cannot reach the daemon at %s: %s" % (args.socket, ex)
+        return 1
+    if not reply["ok"]:
+        print >> sys.stderr, reply["error"]
+        return 1
+    for job in reply.get("jobs", [reply.get("job")] if "job" in reply else []):
+        _print_job(job)
+    if "job" in reply and reply["job"]["result"] is not None:
+        return 0 if reply["job"]["result"]["ok"] else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""Output side of the conversion.
+
+Legacy files are rendered as an iterable of text chunks and handed to a writer.
+The DirectoryWriter pushes the chunks through one buffered file object per
+legacy file, into a temporary file which is renamed into place once complete,
+so a reader never sees a half-written .req file.
+
+The archive writers put every legacy file into a single tar (optionally gzip
+compressed) or zip stream instead, which may also be stdout for tar.  Each file is
+spooled (in memory up to the buffer size) until complete and then appended to the
+archive, so the archive is written sequentially.
+
+Writers have open(filename), a context manager yielding a file to write one legacy
+file to, write(filename, chunks), close() and abort().  Several files of a writer may
+be open at once; write_answers uses that to write a .req file and its answer files
+from a single rendering pass.
+"""
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# tarfile and zipfile are imported by the archive writers; a conversion into a directory
+# does without them.
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# mkstemp creates files readable by the owner only; give the final files the
+# permissions a plain open() would have.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _write_chunks(output, chunks):
+    # Not writelines(): it gathers up to a thousand chunks before writing, and some
+    # chunks are large (SHA LDT messages come in megabyte pieces).
+    write = output.write
+    for chunk in chunks:
+        write(chunk)
+
+
+@contextlib.contextmanager
+def _open_all(writer, filenames):
+    """Open every one of filenames on writer, yielding the files in the same order.
+    They are finished in that order too (the first file goes first into an archive);
+    if the block raises, all of them are discarded."""
+    if not filenames:
+        yield []
+        return
+    with writer.open(filenames[-1]) as last:
+        with _open_all(writer, filenames[:-1]) as rest:
+            yield rest + [last]
+
+
+def write_answers(writer, filenames, pairs):
+    """Write (chunk, answer chunk) pairs, as CAVSAlgorithm.render_legacy_answer_file
+    yields them: the chunks to filenames[0] (the .req file) and the answer chunks to
+    each of the others (the .rsp and .fax files).  All the files are open at once, so
+    the pairs are only gone through once."""
+    with _open_all(writer, filenames) as outputs:
+        write = outputs[0].write
+        answer_writes = [output.write for output in outputs[1:]]
+        for chunk, answer in pairs:
+            write(chunk)
+            for answer_write in answer_writes:
+                answer_write(answer)
+
+
+class AtomicFile(object):
+    """Context manager yielding a buffered file which replaces path on a clean exit
+    and is discarded if the block raises."""
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._path = path
+        self._buffer_size = buffer_size
+        self._tmp = None
+        self._file = None
+
+    def __enter__(self):
+        directory, name = os.path.split(self._path)
+        fd, self._tmp = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp', dir=directory or '.')
+        self._file = os.fdopen(fd, 'wt', self._buffer_size)
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self._file.close()
+        finally:
+            if exc_type is not None:
+                os.unlink(self._tmp)
+        if exc_type is None:
+            os.chmod(self._tmp, 0o666 & ~_umask)
+            os.rename(self._tmp, self._path)
+        return False
+
+
+class DirectoryWriter(object):
+    """Writes each legacy file atomically into a directory."""
+    def __init__(self, out_dir, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.out_dir = out_dir
+        self.buffer_size = buffer_size
+
+    def open(self, filename):
+        return AtomicFile(os.path.join(self.out_dir, filename), self.buffer_size)
+
+    def write(self, filename, chunks):
+        with self.open(filename) as output:
+            _write_chunks(output, chunks)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class _ArchiveMember(object):
+    def __init__(self, archive, name):
+        self._archive = archive
+        self._name = name
+
+    def __enter__(self):
+        self._spool = tempfile.SpooledTemporaryFile(max_size=self._archive.buffer_size, mode='w+b')
+        return self._spool
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                size = self._spool.tell()
+                self._spool.seek(0)
+                self._archive.add(self._name, self._spool, size)
+        finally:
+            self._spool.close()
+        return False
+
+
+class _ArchiveWriter(object):
+    """Base of the archive writers.  out is a path, which is written atomically, or an
+    open file.  Member names may contain directories (vector-set/CBCMMT128.req)."""
+    def __init__(self, out, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._atomic = None
+        if isinstance(out, basestring):
+            self._atomic = AtomicFile(out, buffer_size)
+            self._file = self._atomic.__enter__()
+        else:
+            self._file = out
+
+    def open(self, filename):
+        return _ArchiveMember(self, filename)
+
+    def write(self, filename, chunks):
+        with self.open(filename) as output:
+            _write_chunks(output, chunks)
+
+    def write_file(self, filename, path):
+        """Add a file which is already on disk."""
+        with open(path, 'rb') as f:
+            self.add(filename, f, os.fstat(f.fileno()).st_size)
+
+    def add(self, name, fileobj, size):
+        raise NotImplementedError("Not implemented in %s" % self.__class__.__name__)
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        self._finish()
+        if self._atomic is not None:
+            self._atomic.__exit__(None, None, None)
+        else:
+            self._file.flush()
+
+    def abort(self):
+        """Give up; an archive written to a path is removed."""
+        try:
+            self._finish()
+        except Exception:
+            pass
+        if self._atomic is not None:
+            self._atomic.__exit__(RuntimeError, None, None)
+
+
+class TarWriter(_ArchiveWriter):
+    """Legacy files as members of a tar stream; compression is None, 'gz' or 'bz2'.
+    The stream is written strictly sequentially, so out can be a pipe."""
+    def __init__(self, out, compression=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        import tarfile
+        super(TarWriter, self).__init__(out, buffer_size)
+        self._tar = tarfile.open(fileobj=self._file, mode='w|' + (compression or ''))
+
+    def add(self, name, fileobj, size):
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = time.time()
+        info.mode = 0o666 & ~_umask
+        self._tar.addfile(info, fileobj)
+
+    def _finish(self):
+        self._tar.close()
+
+
+class ZipWriter(_ArchiveWriter):
+    """Legacy files as deflated members of a zip file.  Zip needs a seekable output."""
+    def __init__(self, out, buffer_size=DEFAULT_BUFFER_SIZE):
+        import zipfile
+        super(ZipWriter, self).__init__(out, buffer_size)
+        try:
+            self._file.tell()
+        except IOError:
+            raise ValueError("zip output needs a seekable file; use tar for pipes")
+        self._zip = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def add(self, name, fileobj, size):
+        import zipfile
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = (0o666 & ~_umask) << 16
+        self._zip.writestr(info, fileobj.read())
+
+    def _finish(self):
+        self._zip.close()
+
+
+# Archive formats and the file name endings which select them
+ARCHIVE_FORMATS = (('tar.gz', ('.tar.gz', '.tgz')), ('tar', ('.tar',)), ('zip', ('.zip',)))
+
+
+def archive_format(path):
+    """The archive format a path names (stdout, "-", is tar), or None for a directory."""
+    if path == '-':
+        return 'tar'
+    for fmt, endings in ARCHIVE_FORMATS:
+        if path.lower().endswith(endings):
+            return fmt
+    return None
+
+
+def open_archive(out, fmt=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Archive writer for out, a path, "-" for stdout or an open file.  The format is
+    worked out from the name unless given as fmt ('tar', 'tar.gz' or 'zip')."""
+    if fmt is None:
+        fmt = archive_format(out) if isinstance(out, basestring) else 'tar'
+    if out == '-':
+        out = sys.stdout
+    if fmt == 'zip':
+        return ZipWriter(out, buffer_size)
+    if fmt in ('tar', 'tar.gz'):
+        return TarWriter(out, 'gz' if fmt == 'tar.gz' else None, buffer_size)
+    raise ValueError("Unknown archive format %s" % fmt)
+
+
+# Manifest of an incremental conversion, kept next to the legacy files
+MANIFEST_FILENAME = ".cavs-manifest.json"
+
+
+class Manifest(object):
+    """Hashes of the inputs (see CAVSAlgorithm.legacy_file_hash) of the legacy files in a
+    directory, as of the last incremental conversion into it."""
+    def __init__(self, out_dir, hashes=None):
+        self.path = os.path.join(out_dir, MANIFEST_FILENAME)
+        self.hashes = hashes or {}
+
+    @classmethod
+    def load(cls, out_dir):
+        try:
+            with open(os.path.join(out_dir, MANIFEST_FILENAME)) as f:
+                return cls(out_dir, json.load(f)["files"])
+        except (IOError, ValueError, KeyError):
+            # No usable manifest: everything is out of date
+            return cls(out_dir)
+
+    @staticmethod
+    def discard(out_dir):
+        """Forget the manifest of out_dir, for when its files are replaced by other means."""
+        try:
+            os.unlink(os.path.join(out_dir, MANIFEST_FILENAME))
+        except OSError:
+            pass
+
+    def up_to_date(self, filename, digest):
+        return self.hashes.get(filename) == digest and os.path.exists(os.path.join(os.path.dirname(self.path), filename))
+
+    def save(self):
+        with AtomicFile(self.path) as f:
+            json.dump({"files": self.hashes}, f, indent=2, sort_keys=True)
+
+
+def writer_for(out, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Accept either a writer, a directory name or an archive name (see archive_format)."""
+    if isinstance(out, basestring):
+        if archive_format(out) is not None:
+            return open_archive(out, buffer_size=buffer_size)
+        return DirectoryWriter(out, buffer_size)
+    return out
@@ -0,0 +1,299 @@
+"""Byte offset index of the test groups of a vector set, for converting only some of them.
+
+Converting one slice of a huge vector set (AES 256 bit KeySbox, say) should not mean
+decoding all of it.  The file is memory mapped and scanned once for where every entry
+of testGroups starts and ends, along with the group's scalar keys (tgId, testType,
+direction, keyLen, ...), without decoding the test cases.  On request (--save-index)
+the index is kept next to the vector set as <file>.idx, and reused for as long as
+the file keeps its size and modification time; nothing is written there otherwise.
+
+Selection criteria have the shape of CAVSAlgorithm.findAll's criteria_dict.  Those on
+keys the index has rule groups out before they are decoded; the rest (decorations
+such as _testSubType) are checked once the remaining groups are classified:
+
+    python cavs/groupindex.py ACVP-AES-ECB.json out/ -w keyLen=256 -w _testSubType=KeySbox
+    python cavs/groupindex.py SHA2-256.json out/ --files '*LongMsg.req'
+"""
+import argparse
+import fnmatch
+import json
+import mmap
+import os
+import re
+import sys
+
+import emit
+import instrument
+import registry
+from cavsalg import criteria_match
+
+# Version of the index file format
+INDEX_VERSION = 1
+
+# Not .json, so that the directories of vector sets given to batch.py can hold indexes
+INDEX_SUFFIX = ".idx"
+
+_WS = re.compile(r'[ \t\n\r]*')
+# Everything up to the next bracket or brace, strings (which may hold brackets) included
+_NO_BRACKETS = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_SCALAR = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|-?[0-9][0-9.eE+-]*|true|false|null')
+
+
+class _Scanner(object):
+    """Walks the JSON text in buf (a string or mmap) without decoding the parts it skips."""
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def ws(self):
+        self.pos = _WS.match(self.buf, self.pos).end()
+        return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        c = self.ws()
+        if not c or c not in chars:
+            raise ValueError("Unexpected %r at offset %d; expected one of %r" % (c, self.pos, chars))
+        self.pos += 1
+        return c
+
+    def scalar(self):
+        self.ws()
+        m = _SCALAR.match(self.buf, self.pos)
+        if not m:
+            raise ValueError("Expected a scalar at offset %d" % self.pos)
+        self.pos = m.end()
+        return json.loads(m.group())
+
+    def key(self):
+        self.ws()
+        m = _STRING.match(self.buf, self.pos)
+        if not m:
+            raise ValueError("Expected a key at offset %d" % self.pos)
+        self.pos = m.end()
+        self.expect(':')
+        return json.loads(m.group())
+
+    def skip(self):
+        """Skip one value; arrays and objects are skipped bracket by bracket."""
+        c = self.ws()
+        if c not in ('[', '{'):
+            self.scalar()
+            return
+        depth = 0
+        buf = self.buf
+        pos = self.pos
+        while True:
+            pos = _NO_BRACKETS.match(buf, pos).end()
+            c = buf[pos:pos + 1]
+            if not c:
+                raise ValueError("Unexpected end of ACVP document")
+            pos += 1
+            depth += 1 if c in '[{' else -1
+            if depth == 0:
+                self.pos = pos
+                return
+
+    def group(self):
+        """Skip a test group object, returning its scalar keys."""
+        keys = {}
+        self.expect('{')
+        if self.ws() == '}':
+            self.pos += 1
+            return keys
+        while True:
+            k = self.key()
+            if self.ws() in ('[', '{'):
+                self.skip()
+            else:
+                keys[k] = self.scalar()
+            if self.expect(',}') == '}':
+                return keys
+
+
+def scan(buf):
+    """Index the JSON text of a vector set: the span of the testGroups array and the
+    offset, length and scalar keys of every test group in it."""
+    s = _Scanner(buf)
+    s.expect('[')
+    s.skip()        # header
+    s.expect(',')
+    s.expect('{')
+    index = {"testGroups": None, "groups": []}
+    if s.ws() == '}':
+        return index
+    while True:
+        k = s.key()
+        if k != 'testGroups':
+            s.skip()
+        else:
+            start = s.pos = _WS.match(buf, s.pos).end()
+            s.expect('[')
+            if s.ws() == ']':
+                s.pos += 1
+            else:
+                while True:
+                    offset = s.pos = _WS.match(buf, s.pos).end()
+                    keys = s.group()
+                    index["groups"].append({"offset": offset, "length": s.pos - offset, "keys": keys})
+                    if s.expect(',]') == ']':
+                        break
+            index["testGroups"] = [start, s.pos]
+        if s.expect(',}') == '}':
+            return index
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def load_index(path, persist=False):
+    """The index of the vector set at path: read from <path>.idx when it is still
+    valid, otherwise scanned and, with persist, saved there (when it can be)."""
+    stamp = _stamp(path)
+    try:
+        with open(index_path(path)) as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION and index.get("file") == stamp:
+            instrument.count("group_index", result="reused")
+            return index
+    except (IOError, OSError, ValueError):
+        pass
+
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with instrument.span("index"):
+                index = scan(mm)
+        finally:
+            mm.close()
+    index["version"] = INDEX_VERSION
+    index["file"] = stamp
+    instrument.count("group_index", result="scanned")
+    if persist:
+        try:
+            with emit.AtomicFile(index_path(path)) as f:
+                json.dump(index, f)
+        except (IOError, OSError):
+            # Read only directory; the index just is not kept
+            pass
+    return index
+
+
+def _index_criteria(criteria):
+    """The criteria which can be checked against the index: plain keys only, since
+    decorations only exist once groups are classified."""
+    return dict((k, v) for k, v in criteria.iteritems() if not k.lstrip('!').startswith('_'))
+
+
+def load(path, criteria=None, persist=False):
+    """Load the vector set at path like acvpjson.load does, with only the test groups
+    meeting criteria (if any) decoded, one at a time from a memory map.  Criteria on
+    decorations are not checked here; see CAVSAlgorithm.select."""
+    index = load_index(path, persist)
+    f = open(path, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+
+    if index["testGroups"] is None:
+        j = json.loads(mm[:])
+        mm.close()
+        return j
+    start, end = index["testGroups"]
+    # Everything but the test groups is small
+    j = json.loads(mm[:start] + '[]' + mm[end:])
+    pre = _index_criteria(criteria or {})
+    selected = [g for g in index["groups"] if criteria_match(g["keys"], pre)]
+    instrument.count("groups_selected", len(selected))
+    instrument.count("groups_skipped", len(index["groups"]) - len(selected))
+
+    def groups():
+        try:
+            for g in selected:
+                yield json.loads(mm[g["offset"]:g["offset"] + g["length"]])
+        finally:
+            mm.close()
+    j[1]['testGroups'] = groups()
+    return j
+
+
+def select_files(plan, patterns):
+    """The part of a ConversionPlan whose filenames match one of the glob patterns."""
+    res = plan.__class__()
+    for entry in plan:
+        if any(fnmatch.fnmatchcase(entry["filename"], p) for p in patterns):
+            res.add(entry["filename"], entry["testGroups"])
+    return res
+
+
+def convert(path, out, criteria=None, files=None, persist=False, buffer_size=emit.DEFAULT_BUFFER_SIZE):
+    """Convert the test groups of the vector set at path which meet criteria into out
+    (a directory or archive, see to_cavs), optionally only the legacy files matching
+    the glob patterns in files.  Returns the filenames written."""
+    a = registry.for_json(load(path, criteria, persist))
+    if criteria:
+        a.select(criteria)
+    plan = a.legacy_plan()
+    if files:
+        plan = select_files(plan, files)
+    if not len(plan):
+        raise LookupError("No test groups of %s match the selection" % path)
+    return a.to_cavs(out, plan, buffer_size)
+
+
+def parse_criterion(text):
+    """key=value (or !key=value) into a criteria_dict item; value is taken as JSON
+    when it parses (keyLen=256), as a string otherwise (direction=encrypt)."""
+    k, sep, v = text.partition('=')
+    if not sep or not k.lstrip('!'):
+        raise ValueError("criterion %r is not key=value" % text)
+    try:
+        v = json.loads(v)
+    except ValueError:
+        pass
+    return k, v
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert selected test groups of an ACVP vector set to CAVS files.")
+    parser.add_argument("vector_set")
+    parser.add_argument("out", nargs="?", help="output directory or archive (not needed with --show-index)")
+    parser.add_argument("-w", "--where", action="append", default=[], metavar="KEY=VALUE",
+                        help="only test groups with this key value (!KEY=VALUE for the others); may be repeated")
+    parser.add_argument("--files", action="append", metavar="GLOB", help="only the legacy files matching GLOB; may be repeated")
+    parser.add_argument("--save-index", action="store_true", help="keep the index as <vector set>%s for the next run" % INDEX_SUFFIX)
+    parser.add_argument("--show-index", action="store_true", help="print the test groups of the index and exit")
+    args = parser.parse_args(argv)
+
+    try:
+        criteria = dict(parse_criterion(w) for w in args.where)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    if args.show_index:
+        index = load_index(args.vector_set, args.save_index)
+        for g in index["groups"]:
+            print "%10d %10d  %s" % (g["offset"], g["length"], json.dumps(g["keys"], sort_keys=True))
+        return 0
+
+    if args.out is None:
+        parser.error("an output directory or archive is needed to convert")
+    if not emit.archive_format(args.out) and not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    try:
+        filenames = convert(args.vector_set, args.out, criteria, args.files, args.save_index)
+    except LookupError as ex:
+        print >> sys.stderr, ex
+        return 1
+    for filename in filenames:
+        print filename
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
-import json
+import os
 import sys
 import time
-from pdb import set_trace as bp
-from cavsalg import CAVSAlgorithm
+from cavsalg import CAVSAlgorithm, lower_column, expected_column, DEBUG_TTY
+import acvpjson
+import emit
+import registry
+
+# Order of the underlying hash families in a merged HMAC.req
+_HASH_ORDER = {'SHA-1': 0, 'SHA-2': 1, 'SHA-3': 2}
 
 
 class HMAC(CAVSAlgorithm):
@@ -42,52 +47,77 @@ class HMAC(CAVSAlgorithm):
         })
         return filegroups
 
-    def generate_legacy_group_record(self, group):
-        if 'SHA-1' in self.algorithm:
-            algStr = "SHA_1"
-        elif 'SHA2' in self.algorithm:
-            algStr = "SHA_2"
-        elif 'SHA3' in self.algorithm:
-            algStr = 'SHA_3'        # Untested!
-        else:
-            raise RuntimeError("Unknown underlying hash algorithm %s in HMAC" % self.algorithm)
+    def _legacy_hash(self):
+        if 'SHA-1' in self._meta["algorithm"]:
+            return "SHA_1"
+        elif 'SHA2' in self._meta["algorithm"]:
+            return "SHA_2"
+        elif 'SHA3' in self._meta["algorithm"]:
+            return 'SHA_3'        # Untested!
+        raise RuntimeError("Unknown underlying hash algorithm %s in HMAC" % self._meta["algorithm"])
 
+    def generate_legacy_group_record(self, group):
         return "[L=%s SHAAlg=%s]" % (
             int(group['macLen'])/8,
-            algStr
+            self._legacy_hash()
         )
 
+    def legacy_merged_record(self):
+        """The section of this vector set in a merged HMAC.req: L is the output size in
+        bytes, as in the CAVS HMAC.req, and the MAC length is left to Tlen.  Truncated
+        hashes (SHA2-512/224) get their own SHAAlg, not to share a section with the
+        hash of the same output size."""
+        algStr = self._legacy_hash()
+        if '/' in self._meta["algorithm"]:
+            algStr += '_' + self._meta["algorithm"].rsplit('-', 1)[1].replace('/', '_')
+        return "[L=%d SHAAlg=%s]" % (self._outputSize/8, algStr)
+
+    _RECORD = "Count = %d\nKlen = %d\nTlen = %d\nKey = %s\nMsg = %s"
+
+    def render_legacy_test_group(self, group, tests=None, first_count=0):
+        """first_count is the Count of the first test case of the group, for groups
+        continuing a section started by other groups (see merge_to_cavs)."""
+        tests = group["tests"] if tests is None else tests
+        base = int(group['tests'][0]['tcId']) - first_count
+        klen = int(group['keyLen'])/8
+        tlen = int(group['macLen'])/8      # Truncated length?
+
+        records = []
+        for test, key, msg in zip(tests, lower_column(tests, 'key'), lower_column(tests, 'msg')):
+            records.append(self._RECORD % (int(test['tcId']) - base, klen, tlen, key, msg))
+        return records
+
     def generate_legacy_test_case_record(self, group, test):
-        count = int(test['tcId']) - int(group['tests'][0]['tcId'])
-        klen = int(group['keyLen'])
-        tlen = int(group['macLen'])      # Truncated length?
-        key = test['key'].lower()
-        msg = test['msg'].lower()
+        return self.render_legacy_test_group(group, [test])[0]
 
-        res = """Count = {count}
-Klen = {klen}
-Tlen = {tlen}
-Key = {key}
-Msg = {msg}""".format(count=count, klen=klen/8, tlen=tlen/8, key=key, msg=msg)
 
-        return res
+    def legacy_response_fields(self, group, test, record):
+        return {"mac": record['Mac'].upper()}
+
+    def legacy_answer_records(self, group, tests, records):
+        return ["%s\nMac = %s" % (record, mac) for record, mac in zip(records, expected_column(tests, 'mac'))]
+
+
+    _HEADER = """#  CAVS 21.4
+#  HMAC information for TBD
+#  Hash sizes/Hash algorithms tested: {tested}
+#  Generated on {ctime}"""
 
+    def legacy_tested(self):
+        return "{outsize} with  {algStr}".format(outsize=int(self._outputSize)/8, algStr=self._underlyingHash)
 
     def generate_legacy_header(self, groups, py_timestamp):
         """Generate a legacy header.
         Parameter is a timestamp as a python object."""
 
         # Hmmm, ACVP only has one algorithm per vector set. Unlike CAVS which bundles them.
-        tested = "{outsize} with  {algStr}".format(outsize=int(self._outputSize)/8, algStr=self._underlyingHash)
+        # merge_to_cavs puts them back together.
+        return self._HEADER.format(tested=self.legacy_tested(), ctime=time.ctime(py_timestamp))
 
-        header = """#  CAVS 21.4
-#  HMAC information for TBD
-#  Hash sizes/Hash algorithms tested: {tested}
-#  Generated on {ctime}""".format(
-            tested=tested,
-            ctime=time.ctime(py_timestamp)
-        )
-        return header
+    def merge_key(self):
+        """Where this vector set goes in a merged HMAC.req: by output size, then hash family
+        (then name, for the truncated hashes)."""
+        return (self._outputSize, _HASH_ORDER.get(self._underlyingHash, len(_HASH_ORDER)), '/' in self._meta["algorithm"], self._meta["algorithm"])
 
 
 
@@ -95,16 +125,83 @@ Msg = {msg}""".format(count=count, klen=klen/8, tlen=tlen/8, key=key, msg=msg)
         return tg["testType"]        # Default is to return the actual test type
 
 
+def _render_merged(algs, py_timestamp):
+    yield HMAC._HEADER.format(tested=", ".join(a.legacy_tested() for a in algs), ctime=time.ctime(py_timestamp)) + "\n"
+
+    # A section per hash (legacy_merged_record), in the order of algs; the vector sets of
+    # the same hash are next to each other there and share it, with Count running on.
+    record = None
+    count = 0
+    for a in algs:
+        a_record = a.legacy_merged_record()
+        if a_record != record:
+            yield "\n" + a_record + "\n"
+            record = a_record
+            count = 0
+        for group in a.testGroups:
+            for r in a.render_legacy_test_group(group, first_count=count):
+                yield "\n" + r + "\n"
+            count += len(group['tests'])
+
+
+def merge_to_cavs(vector_sets, out_dir, buffer_size=emit.DEFAULT_BUFFER_SIZE):
+    """Write the HMAC vector sets (parsed [header, vectorSet] envelopes) into a single
+    HMAC.req in out_dir (a directory, archive or writer, as for to_cavs) and return its name.
+
+    Every hash gets one [L= SHAAlg=] section, L being its output size in bytes and Tlen
+    the MAC length of each test case, ordered by output size and hash family.  That key
+    is the same for all the groups of a vector set, so it is known from the envelope
+    before any group is read: with streamed vector sets (acvpjson.load) only one test
+    group is in memory at a time, whatever the number of vector sets."""
+    algs = []
+    for j in vector_sets:
+        a = registry.for_json(j)
+        if not isinstance(a, HMAC):
+            raise ValueError("%s is not an HMAC vector set" % j[1].get('algorithm'))
+        algs.append(a)
+    # sorted() is stable, so vector sets with the same key keep their order
+    algs = sorted(algs, key=lambda a: a.merge_key())
+
+    filename = 'HMAC.req'
+    writer = emit.writer_for(out_dir, buffer_size)
+    try:
+        writer.write(filename, _render_merged(algs, time.time()))
+    except:
+        if writer is not out_dir:
+            writer.abort()
+        raise
+    if writer is not out_dir:
+        writer.close()
+    return filename
+
+
+def merge_files(paths, out_dir, buffer_size=emit.DEFAULT_BUFFER_SIZE):
+    """merge_to_cavs for vector set files, which are streamed in."""
+    files = [open(path) for path in paths]
+    try:
+        return merge_to_cavs([acvpjson.load(f) for f in files], out_dir, buffer_size)
+    finally:
+        for f in files:
+            f.close()
+
+
+def converter(vs):
+    """Registry factory (see registry.py)."""
+    return HMAC(vs['algorithm'])
+
+
 if __name__ == "__main__":
-    j = json.loads("\n".join(sys.stdin.readlines()))
-    # To help with debugging with pdb after reading from stdin
-    sys.stdin = open('/dev/tty')
+    j = acvpjson.load(sys.stdin)
+    if os.environ.get(DEBUG_TTY):
+        # To help with debugging with pdb; the reader keeps its own handle on the original stdin
+        sys.stdin = open('/dev/tty')
 
     try:
         outdir = sys.argv[1]
     except IndexError:
         outdir = "."
 
-    a = HMAC(j[1]['algorithm'])
+    # Not registry.for_json, which would import this file again as a module of its own
+    a = converter(j[1])
     a.json = j
     a.to_cavs(outdir)
@@ -0,0 +1,202 @@
+"""Instrumentation: spans, counters and events, handed to pluggable sinks.
+
+Nothing is measured unless a sink is installed; with no sinks span() returns a shared
+do-nothing context manager and count()/event() return right away, so the calls can
+stay in the conversion code for good.  Loops should still check enabled() once rather
+than calling into this module for every test case.
+
+    instrument.add_sink(instrument.JSONLinesSink("metrics.jsonl"))
+    instrument.add_sink(instrument.PrometheusTextfileSink("cavs.prom"))
+    ...
+    instrument.close()
+
+Every measurement is a plain dict (an "event"):
+
+    {"type": "span", "name": "render", "seconds": 0.01, "labels": {...}, "time": ...}
+    {"type": "counter", "name": "bytes_written", "value": 1234, "labels": {...}, "time": ...}
+    {"type": "event", "name": "findall_error", "labels": {...}, "time": ...}
+"""
+import json
+import time
+from contextlib import contextmanager
+
+import emit
+
+_sinks = []
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def close():
+    """Flush and remove every sink."""
+    while _sinks:
+        _sinks.pop().close()
+
+
+def _emit(ev):
+    for sink in _sinks:
+        sink.emit(ev)
+
+
+def replay(events):
+    """Hand events recorded elsewhere (another process, see capture) to the sinks."""
+    if _sinks:
+        for ev in events:
+            _emit(ev)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        observe(self.name, time.time() - self._start, **self.labels)
+        return False
+
+
+def span(name, **labels):
+    """Context manager timing its block."""
+    if not _sinks:
+        return _NULL_SPAN
+    return _Span(name, labels)
+
+
+def observe(name, seconds, **labels):
+    """A span which was timed by the caller."""
+    if _sinks:
+        _emit({"type": "span", "name": name, "seconds": seconds, "labels": labels, "time": time.time()})
+
+
+def count(name, value=1, **labels):
+    if _sinks:
+        _emit({"type": "counter", "name": name, "value": value, "labels": labels, "time": time.time()})
+
+
+def event(name, **labels):
+    if _sinks:
+        _emit({"type": "event", "name": name, "labels": labels, "time": time.time()})
+
+
+class Recorder(object):
+    """Sink keeping the events in a list."""
+    def __init__(self):
+        self.events = []
+
+    def emit(self, ev):
+        self.events.append(ev)
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def capture():
+    """Send everything measured in the block to a Recorder only, which is yielded.
+    Worker processes use this to ship their events back for replay()."""
+    global _sinks
+    saved = _sinks
+    recorder = Recorder()
+    _sinks = [recorder]
+    try:
+        yield recorder
+    finally:
+        _sinks = saved
+
+
+class JSONLinesSink(object):
+    """One JSON object per line, appended to a file (a path or an open file)."""
+    def __init__(self, out):
+        if isinstance(out, basestring):
+            self._file = open(out, 'at')
+            self._owned = True
+        else:
+            self._file = out
+            self._owned = False
+
+    def emit(self, ev):
+        self._file.write(json.dumps(ev, sort_keys=True) + "\n")
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda v: unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{%s}" % ",".join('%s="%s"' % (k, escape(v)) for k, v in sorted(labels.iteritems()))
+
+
+class PrometheusTextfileSink(object):
+    """Aggregates counters and spans and writes them in the Prometheus text format when
+    closed (or flushed), for the node exporter textfile collector.  Events are not kept.
+
+    Counters become cavs_<name>_total, spans cavs_<name>_seconds summaries (sum and count).
+    """
+    def __init__(self, path, prefix="cavs_"):
+        self.path = path
+        self.prefix = prefix
+        self._counters = {}
+        self._spans = {}
+
+    def emit(self, ev):
+        key = (ev["name"], tuple(sorted(ev["labels"].iteritems())))
+        if ev["type"] == "counter":
+            self._counters[key] = self._counters.get(key, 0) + ev["value"]
+        elif ev["type"] == "span":
+            total, n = self._spans.get(key, (0.0, 0))
+            self._spans[key] = (total + ev["seconds"], n + 1)
+
+    def lines(self):
+        res = []
+        for name in sorted(set(k[0] for k in self._counters)):
+            metric = "%s%s_total" % (self.prefix, name)
+            res.append("# TYPE %s counter" % metric)
+            for key in sorted(k for k in self._counters if k[0] == name):
+                res.append("%s%s %s" % (metric, _prometheus_labels(dict(key[1])), self._counters[key]))
+        for name in sorted(set(k[0] for k in self._spans)):
+            metric = "%s%s_seconds" % (self.prefix, name)
+            res.append("# TYPE %s summary" % metric)
+            for key in sorted(k for k in self._spans if k[0] == name):
+                total, n = self._spans[key]
+                labels = _prometheus_labels(dict(key[1]))
+                res.append("%s_sum%s %r" % (metric, labels, total))
+                res.append("%s_count%s %d" % (metric, labels, n))
+        return res
+
+    def flush(self):
+        # Written atomically so the collector never reads half a file
+        with emit.AtomicFile(self.path) as f:
+            f.write("\n".join(self.lines()) + "\n")
+
+    def close(self):
+        self.flush()
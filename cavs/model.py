@@ -0,0 +1,184 @@
+"""Compact in-memory model of an ACVP vector set.
+
+The parsed JSON is a tree of dicts holding every hex field as a (unicode) string,
+which is several times the size of the data it describes.  The classes here keep
+test groups and test cases in __slots__ objects, the hex fields as raw bytes and
+the sub type tags as shared SubType instances.
+
+They still behave like the dicts they replace (tg['keyLen'], 'iv' in tc, tc.get(...))
+so every converter works on them unchanged; hex fields read that way come back as
+lower case hex strings.  Code that knows about the model can skip that and use the
+attributes directly (see hex_column).
+"""
+import binascii
+
+# Hex encoded ACVP fields which are kept as raw bytes
+HEX_FIELDS = frozenset(['key', 'iv', 'pt', 'ct', 'msg', 'md', 'mac'])
+
+_missing = object()
+
+
+class SubType(str):
+    """Sub type tag (MMT, KeySbox, ShortMsg, ...).  Python 2 has no enum module, so this
+    is a str whose instances are shared: every tagged group or test case refers to the
+    same object, and it compares, formats and hashes like the plain string."""
+    _tags = {}
+
+    @classmethod
+    def of(cls, name):
+        if isinstance(name, cls):
+            return name
+        try:
+            return cls._tags[name]
+        except KeyError:
+            tag = cls._tags[name] = cls(name)
+            return tag
+
+
+# Keys holding sub type tags
+_SUBTYPE_KEYS = frozenset(['_testSubType', '_testCaseSubType'])
+
+
+class _Record(object):
+    """Dict-like access over __slots__, with anything unexpected kept in _extra."""
+    __slots__ = ('_extra',)
+
+    def __init__(self, d=None):
+        self._extra = None
+        if d:
+            for k, v in d.iteritems():
+                self[k] = v
+
+    def __getitem__(self, k):
+        v = getattr(self, k, _missing) if k in self._fields else _missing
+        if v is _missing:
+            if self._extra is not None and k in self._extra:
+                return self._extra[k]
+            raise KeyError(k)
+        if k in HEX_FIELDS:
+            return binascii.hexlify(v)
+        return v
+
+    def __setitem__(self, k, v):
+        if k in HEX_FIELDS and k in self._fields:
+            try:
+                v = binascii.unhexlify(v)
+            except (TypeError, ValueError):
+                # Not byte aligned hex; keep the value as it came
+                self._set_extra(k, v)
+                return
+        elif k in _SUBTYPE_KEYS:
+            v = SubType.of(v)
+        if k in self._fields:
+            setattr(self, k, v)
+        else:
+            self._set_extra(k, v)
+
+    def _set_extra(self, k, v):
+        if k in self._fields and getattr(self, k, _missing) is not _missing:
+            delattr(self, k)
+        if self._extra is None:
+            self._extra = {}
+        self._extra[k] = v
+
+    def __contains__(self, k):
+        if k in self._fields and getattr(self, k, _missing) is not _missing:
+            return True
+        return self._extra is not None and k in self._extra
+
+    has_key = __contains__
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def keys(self):
+        res = [k for k in self._fields if getattr(self, k, _missing) is not _missing]
+        if self._extra:
+            res.extend(self._extra.keys())
+        return res
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iteritems(self):
+        for k in self.keys():
+            yield k, self[k]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self._fields + ('_extra',) if hasattr(self, k))
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
+
+    def to_acvp(self):
+        """Back to the plain ACVP JSON form, hex in upper case; decorations are dropped."""
+        res = {}
+        for k, v in self.iteritems():
+            if k.startswith('_'):
+                continue
+            if k in HEX_FIELDS and k in self._fields and getattr(self, k, _missing) is not _missing:
+                v = v.upper()
+            res[k] = v
+        return res
+
+
+class TestCase(_Record):
+    _fields = ('tcId', 'key', 'iv', 'pt', 'ct', 'msg', 'md', 'mac', 'len', 'payloadLen', '_testCaseSubType')
+    __slots__ = _fields
+
+
+class TestGroup(_Record):
+    _fields = ('tgId', 'testType', 'direction', 'keyLen', 'macLen', 'msgLen', 'tests', '_testSubType', '_profile')
+    __slots__ = _fields
+
+    def __setitem__(self, k, v):
+        if k == 'tests':
+            v = [tc if isinstance(tc, TestCase) else TestCase(tc) for tc in v]
+        super(TestGroup, self).__setitem__(k, v)
+
+    def to_acvp(self):
+        res = super(TestGroup, self).to_acvp()
+        if 'tests' in res:
+            res['tests'] = [tc.to_acvp() for tc in res['tests']]
+        return res
+
+
+def to_plain(obj):
+    """Plain ACVP JSON form of any part of a vector set, model objects or not: the '_'
+    decorations added by legacy_preprocess are dropped."""
+    if isinstance(obj, _Record):
+        obj = obj.to_acvp()
+    if isinstance(obj, dict):
+        return dict((k, to_plain(v)) for k, v in obj.iteritems() if not k.startswith('_'))
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    return obj
+
+
+def load_groups(test_groups):
+    """Convert the parsed test groups one at a time (test_groups may be a generator)."""
+    for tg in test_groups:
+        yield tg if isinstance(tg, TestGroup) else TestGroup(tg)
+
+
+def hex_column(tests, field):
+    """Lower case hex for one field across a list of TestCases, None where it is missing."""
+    res = []
+    for tc in tests:
+        v = getattr(tc, field, None)
+        if v is None:
+            v = tc.get(field)
+            res.append(v.lower() if v is not None else None)
+        else:
+            res.append(binascii.hexlify(v))
+    return res
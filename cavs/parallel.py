@@ -0,0 +1,133 @@
+"""Classification and rendering of the test groups of one vector set on several cores.
+
+The workers are forked once the groups are in memory and work on their own copies of
+them, so only group positions go out and only results come back: the sub type,
+scalar decorations (keys starting with '_') and test case decorations (those listed in
+_test_case_decorations, SHA's _testCaseSubType) of every group, or its rendered
+records.  Decorations which are not scalars, like the AES _profile holding the test
+cases of the group, stay behind; the parent rebuilds them when it needs them.  Results
+are handed back in group order, so indexing and output stay exactly as in a serial
+conversion.
+
+Forking needs a platform with fork(); this is what CAVSAlgorithm.use_workers sets up.
+"""
+from multiprocessing import Pool
+
+import instrument
+from cavsalg import _SCALARS
+
+# (algorithm, groups) the forked workers work on; only set while the pool is made
+_work = None
+
+
+def _fork(alg, groups, workers):
+    global _work
+    _work = (alg, groups)
+    try:
+        return Pool(workers)
+    finally:
+        _work = None
+
+
+def _decorations(record):
+    return dict((k, v) for k, v in record.iteritems() if k.startswith('_') and isinstance(v, _SCALARS))
+
+
+def _captured(fn, arg):
+    """fn(arg), plus what it measured for instrument.replay() in the parent; the sinks
+    the worker inherited are not its to write to."""
+    if not instrument.enabled():
+        return fn(arg), []
+    with instrument.capture() as recorder:
+        res = fn(arg)
+    return res, recorder.events
+
+
+def _classify_chunk(indexes):
+    alg, groups = _work
+    res = []
+    for i in indexes:
+        tg = groups[i]
+        subType = alg.detect_test_sub_type(tg)
+        columns = {}
+        for k in alg._test_case_decorations:
+            column = [tc.get(k) for tc in tg['tests']]
+            if any(v is not None for v in column):
+                columns[k] = column
+        res.append((subType, _decorations(tg), columns))
+    return res
+
+
+def _classify(indexes):
+    return _captured(_classify_chunk, indexes)
+
+
+def classify(alg, groups, workers, chunk_groups=None):
+    """detect_test_sub_type of every group in groups (a list) on workers processes,
+    chunk_groups at a time.  The decorations it adds are copied onto the groups and
+    their test cases; returns the sub types in group order."""
+    if not chunk_groups:
+        chunk_groups = max(1, len(groups) // (workers * 4))
+    chunks = [range(i, min(i + chunk_groups, len(groups))) for i in xrange(0, len(groups), chunk_groups)]
+    subTypes = []
+    pool = _fork(alg, groups, workers)
+    try:
+        for chunk, (results, events) in zip(chunks, pool.imap(_classify, chunks)):
+            instrument.replay(events)
+            for i, (subType, decorations, columns) in zip(chunk, results):
+                tg = groups[i]
+                for k, v in decorations.iteritems():
+                    tg[k] = v
+                for k, column in columns.iteritems():
+                    for tc, v in zip(tg['tests'], column):
+                        if v is not None:
+                            tc[k] = v
+                subTypes.append(subType)
+    finally:
+        pool.close()
+        pool.join()
+    return subTypes
+
+
+def _render_group(task):
+    alg, files = _work
+    f, i = task
+    return "".join(alg.render_legacy_test_group_chunks(files[f][i]))
+
+
+def _render(task):
+    return _captured(_render_group, task)
+
+
+class GroupRenderer(object):
+    """Renders the test groups of the files of a plan on workers processes, forked
+    when it is made (after classification, so they see the decorations)."""
+    def __init__(self, alg, plan, workers):
+        self._alg = alg
+        self._files = [file_groups["testGroups"] for file_groups in plan]
+        self._index = dict((file_groups["filename"], f) for f, file_groups in enumerate(plan))
+        self._pool = _fork(alg, self._files, workers)
+
+    def group_chunks(self, filename):
+        """Stand-in for render_legacy_test_group_chunks while rendering filename; the
+        groups of the file are all queued now and handed out in order.  Groups too
+        big to render in one piece (legacy_group_fits_in_memory) stay in this process."""
+        f = self._index[filename]
+        fits = [self._alg.legacy_group_fits_in_memory(g) for g in self._files[f]]
+        results = self._pool.imap(_render, [(f, i) for i, ok in enumerate(fits) if ok])
+
+        def chunks(group):
+            if not self._alg.legacy_group_fits_in_memory(group):
+                return self._alg.render_legacy_test_group_chunks(group)
+            text, events = results.next()
+            instrument.replay(events)
+            return [text]
+        return chunks
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def abort(self):
+        self._pool.terminate()
+        self._pool.join()
@@ -0,0 +1,130 @@
+"""Conversion as a pipeline of generators, holding one test group at a time.
+
+to_cavs() normally classifies and indexes the whole vector set, plans every legacy file
+and only then renders them.  With pipeline=True the test groups go through these stages
+one by one instead, each stage a generator pulling from the one before it:
+
+    decode    the test groups, as acvpjson.load streams them in
+    classify  detect_test_sub_type (and select())
+    route     the legacy files the group goes to, found by planning the group on its own
+              with legacy_file_groups
+    spool     the group's records, appended to a spool file for every legacy file
+    write     once all groups are through: the header of every file followed by its
+              spool, in plan order
+
+So no more than one group is ever decoded.  Once its records are spooled the group is
+released and only its stub (legacy_group_stub) is kept; the headers and the order of
+the files are worked out from the stubs at the end.  Headers may depend on every group
+of a file (AES states, SHA bit or byte orientation), which is why the file bodies are
+spooled rather than written as they come.
+
+Spools start in memory and go to disk past SPOOL_MEMORY bytes.
+"""
+import tempfile
+import time
+from itertools import chain
+
+import cavsalg
+import instrument
+from plan import ConversionPlan
+
+SPOOL_MEMORY = 1024 * 1024
+
+
+def classify(alg, groups):
+    """Classified groups, without those select() leaves out."""
+    measure = instrument.enabled()
+    algorithm = alg._vectors.get('algorithm')
+    for tg in groups:
+        if measure:
+            with instrument.span("classify", algorithm=algorithm):
+                tg['_testSubType'] = alg.detect_test_sub_type(tg)
+            instrument.event("classified", algorithm=algorithm, tgId=tg['tgId'], subType=tg['_testSubType'])
+        else:
+            tg['_testSubType'] = alg.detect_test_sub_type(tg)
+        if alg._selection is not None and not cavsalg.criteria_match(tg, alg._selection):
+            continue
+        yield tg
+
+
+def _plan_groups(alg, groups):
+    """Index groups afresh and plan them with legacy_file_groups."""
+    alg._indexes = {'testType': {}, '_testSubType': {}}
+    alg._vectors['testGroups'] = groups
+    for tg in groups:
+        alg.legacy_index_group(tg)
+    return ConversionPlan.from_file_groups(alg.legacy_file_groups())
+
+
+def route(alg, groups):
+    """(group, plan of the group alone): which files it goes to, and what of it goes
+    into each (all of it, or with SHA the test cases of one sub type)."""
+    for tg in groups:
+        yield tg, _plan_groups(alg, [tg])
+
+
+class _Spool(object):
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(SPOOL_MEMORY)
+        # Whether a group synthesized from test cases was spooled already
+        self.synthesized = False
+
+
+def spool(alg, routed, spools):
+    """Append the records of every routed group to spools (filename to _Spool) and
+    yield the stubs of the groups."""
+    for tg, plan in routed:
+        for entry in plan:
+            s = spools.get(entry["filename"])
+            if s is None:
+                s = spools[entry["filename"]] = _Spool()
+            for group in entry["testGroups"]:
+                # Synthesized groups (SHA ShortMsg/LongMsg) of one file are a single group
+                # made of the test cases of every group, so they share one group record
+                synthesized = 'tgId' not in group
+                if not (synthesized and s.synthesized):
+                    s.file.write("\n" + alg.generate_legacy_group_record(group) + "\n")
+                s.synthesized = s.synthesized or synthesized
+                for chunk in alg.render_legacy_test_group_chunks(group):
+                    s.file.write(chunk)
+        yield alg.legacy_group_stub(tg)
+
+
+def convert(alg, writer, buffer_size):
+    """Run the pipeline over alg's test groups into writer (see emit).  Returns the plan,
+    which is made of the stubs; alg is left holding the stubs as its test groups."""
+    measure = instrument.enabled()
+    algorithm = alg._vectors.get('algorithm')
+    spools = {}
+    alg.written_files = []
+    try:
+        start = time.time()
+        groups = alg._vectors['testGroups']
+        stubs = list(spool(alg, route(alg, classify(alg, groups)), spools))
+        with instrument.span("plan", algorithm=algorithm):
+            plan = _plan_groups(alg, stubs)
+        instrument.observe("pipeline", time.time() - start, algorithm=algorithm)
+        instrument.count("groups", len(stubs), algorithm=algorithm)
+
+        for entry in plan:
+            filename = entry["filename"]
+            f = spools[filename].file
+            f.seek(0)
+            header = alg.generate_legacy_header(entry["testGroups"], time.time()) + "\n"
+            chunks = chain([header], iter(lambda: f.read(buffer_size), ''))
+            if measure:
+                size = [0]
+                with instrument.span("emit", algorithm=algorithm):
+                    writer.write(filename, cavsalg._measured(chunks, size))
+                instrument.count("files_written", algorithm=algorithm)
+                instrument.count("bytes_written", size[0], algorithm=algorithm)
+                instrument.event("file_written", algorithm=algorithm, file=filename, bytes=size[0])
+            else:
+                writer.write(filename, chunks)
+            alg.written_files.append(filename)
+            # Done with it; let it go before the next one is copied out
+            spools.pop(filename).file.close()
+    finally:
+        for s in spools.itervalues():
+            s.file.close()
+    return plan
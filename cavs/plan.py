@@ -0,0 +1,83 @@
+import json
+
+
+class ConversionPlan(object):
+    """The legacy files to write for a vector set, each listed exactly once along with
+    its test groups in output order.
+
+    A plan is built from legacy_file_groups() after legacy_preprocess() and can be handed
+    to to_cavs() as many times as needed.  It can also be dumped to JSON for inspection;
+    test groups are referred to by tgId, or by tcIds for the groups which are synthesized
+    from test cases (SHA ShortMsg/LongMsg).
+    """
+    def __init__(self):
+        self._entries = []
+        self._by_filename = {}
+
+    @classmethod
+    def from_file_groups(cls, file_groups):
+        plan = cls()
+        for fg in file_groups:
+            plan.add(fg["filename"], fg["testGroups"])
+        return plan
+
+    def add(self, filename, testGroups):
+        # Several test groups may lead to the same file; the first one describes it fully.
+        if filename in self._by_filename:
+            return self._by_filename[filename]
+        entry = {"filename": filename, "testGroups": testGroups}
+        self._entries.append(entry)
+        self._by_filename[filename] = entry
+        return entry
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, filename):
+        return self._by_filename[filename]
+
+    def filenames(self):
+        return [e["filename"] for e in self._entries]
+
+    @staticmethod
+    def _describe_group(tg):
+        if 'tgId' in tg:
+            desc = {"tgId": tg['tgId']}
+            for k in ('testType', '_testSubType', 'direction', 'keyLen'):
+                if k in tg:
+                    desc[k] = tg[k]
+        else:
+            desc = {"tcIds": [tc['tcId'] for tc in tg['tests']]}
+        desc["tests"] = len(tg['tests'])
+        return desc
+
+    def to_json(self):
+        return [{"filename": e["filename"], "testGroups": [self._describe_group(tg) for tg in e["testGroups"]]}
+                for e in self._entries]
+
+    def dump(self, fp):
+        json.dump(self.to_json(), fp, indent=2, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, data, alg):
+        """Rebuild a plan from to_json() output against the (preprocessed) vector set in alg."""
+        groups = {}
+        tests = {}
+        for tg in alg.testGroups:
+            groups[tg['tgId']] = tg
+            for tc in tg['tests']:
+                tests[tc['tcId']] = tc
+
+        plan = cls()
+        for e in data:
+            testGroups = []
+            for desc in e["testGroups"]:
+                if "tgId" in desc:
+                    testGroups.append(groups[desc["tgId"]])
+                else:
+                    testGroups.append({'tests': [tests[tcId] for tcId in desc["tcIds"]]})
+            plan.add(e["filename"], testGroups)
+        return plan
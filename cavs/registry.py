@@ -0,0 +1,98 @@
+"""Dispatch from ACVP algorithm/mode strings to the CAVSAlgorithm that converts them.
+
+A factory is called with the ACVP vectorSet (without having to look at the test
+groups) and returns a ready-to-use CAVSAlgorithm instance.  It may be registered as
+"module:function" instead of a callable, in which case the module is only imported the
+first time a vector set needs it; the converters of this package are registered that
+way below, so converting a SHA vector set never imports the AES converter (nor numpy).
+
+A factory registered for a prefix takes the algorithms no other registration names,
+as the per-algorithm scripts did before the registry: any ACVP-AES-* mode, and any
+HMAC-SHA* and SHA* variant the converter classes themselves accept.
+"""
+import importlib
+
+_factories = {}
+_prefixes = {}
+
+
+class NoConverter(LookupError):
+    """No converter is registered for the algorithm of a vector set."""
+
+
+def _key(algorithm, mode=None):
+    return (algorithm.upper(), mode.upper() if mode else None)
+
+
+def register(algorithm, factory, mode=None):
+    _factories[_key(algorithm, mode)] = factory
+
+
+def register_prefix(prefix, factory):
+    """Register factory for every algorithm starting with prefix which has no
+    registration of its own; the longest matching prefix wins."""
+    _prefixes[prefix.upper()] = factory
+
+
+def registered():
+    return sorted(_factories.keys())
+
+
+def _factory(key, table=_factories):
+    factory = table[key]
+    if isinstance(factory, basestring):
+        module, sep, name = factory.partition(':')
+        if not sep:
+            raise ValueError("Converter %r for %s is not module:function" % (factory, key))
+        factory = table[key] = getattr(importlib.import_module(module), name)
+    return factory
+
+
+def load_all():
+    """Import every converter registered as "module:function" now, for processes which
+    are about to fork workers that should not each import them on their own."""
+    for key in _factories.keys():
+        _factory(key)
+    for prefix in _prefixes.keys():
+        _factory(prefix, _prefixes)
+
+
+def lookup(vector_set):
+    """Return a CAVSAlgorithm instance for the given ACVP vectorSet (the second
+    element of the [header, vectorSet] envelope).
+    A registration with a specific mode wins over one registered for the bare algorithm,
+    and both over one registered for a prefix.
+    """
+    algorithm = vector_set.get('algorithm')
+    if algorithm is None:
+        raise ValueError("Vector set has no algorithm")
+    mode = vector_set.get('mode')
+    for key in (_key(algorithm, mode), _key(algorithm)):
+        if key in _factories:
+            return _factory(key)(vector_set)
+    matches = [prefix for prefix in _prefixes if algorithm.upper().startswith(prefix)]
+    if matches:
+        return _factory(max(matches, key=len), _prefixes)(vector_set)
+    if mode:
+        raise NoConverter("No converter registered for algorithm %s mode %s" % (algorithm, mode))
+    raise NoConverter("No converter registered for algorithm %s" % algorithm)
+
+
+def for_json(j):
+    """Look up the converter for a [header, vectorSet] envelope and load it."""
+    a = lookup(j[1])
+    a.json = j
+    return a
+
+
+# The converters of this package.  The AES mode is the tail of the ACVP algorithm name,
+# e.g. ACVP-AES-CFB128.
+for _mode in ('ECB', 'CBC', 'OFB', 'CTR', 'CFB1', 'CFB8', 'CFB128'):
+    register('ACVP-AES-%s' % _mode, 'aes:converter')
+for _name in ('SHA-1', 'SHA2-224', 'SHA2-256', 'SHA2-384', 'SHA2-512'):
+    register(_name, 'sha:converter')
+    register('HMAC-' + _name, 'hmac:converter')
+# Whatever else the converters take (other AES modes, HMAC-SHA3-*, HMAC-SHA2-512/224, ...)
+register_prefix('ACVP-AES-', 'aes:converter')
+register_prefix('HMAC-SHA', 'hmac:converter')
+register_prefix('SHA', 'sha:converter')
@@ -0,0 +1,174 @@
+"""Turn CAVS response files back into an ACVP response.
+
+The .rsp files come back from the implementation under test with the same layout as
+the .req files we generated: a header, then a [section] per test group with one
+record per test case (or, for monte carlo tests, one record per iteration).  Since
+both sides follow the conversion plan, the n-th section of a file is the n-th test
+group of the plan entry and the records line up with its test cases.
+
+    python cavs/rsp.py vector-set.json rsp-dir/ > response.json
+"""
+import json
+import mmap
+import os
+import sys
+from collections import OrderedDict
+
+import acvpjson
+import registry
+
+
+def iter_records(path):
+    """Yield ('section', text) and ('record', dict) items from a CAVS file in a single
+    pass over a memory map of it, so large files are never read in whole.
+    Comment lines are skipped and records are separated by blank lines."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            record = {}
+            for line in iter(mm.readline, ''):
+                line = line.strip()
+                if not line or line[0] in '#[':
+                    if record:
+                        yield ('record', record)
+                        record = {}
+                    if line[:1] == '[':
+                        yield ('section', line.strip('[]').strip())
+                    continue
+                name, sep, value = line.partition('=')
+                if sep:
+                    record[name.rstrip()] = value.lstrip()
+            if record:
+                yield ('record', record)
+        finally:
+            mm.close()
+
+
+def response_filename(filename):
+    return os.path.splitext(filename)[0] + '.rsp'
+
+
+def _test_case(filename, group, index):
+    if index >= len(group['tests']):
+        raise ValueError("%s: more records than test cases (%d) in a section" % (filename, len(group['tests'])))
+    return group['tests'][index]
+
+
+def test_owners(alg):
+    """Map id() of every test case to its ACVP test group.  Some legacy groups are made
+    of test cases from several ACVP groups (SHA), so this is the way back to the tgId."""
+    owners = {}
+    for tg in alg.testGroups:
+        for tc in tg['tests']:
+            owners[id(tc)] = tg
+    return owners
+
+
+def iter_responses(alg, rsp_dir, plan=None):
+    """Yield (filename, tg, tc, fields) for every answer found in the response files of
+    rsp_dir.  tg is the ACVP test group the test case tc belongs to, fields its ACVP
+    response fields; for monte carlo tests fields is {'resultsArray': [...]}.
+    Files of the plan which have no response file are skipped."""
+    if plan is None:
+        plan = alg.legacy_plan()
+
+    owners = test_owners(alg)
+
+    for file_groups in plan:
+        filename = response_filename(file_groups["filename"])
+        path = os.path.join(rsp_dir, filename)
+        if not os.path.exists(path):
+            continue
+
+        groups = file_groups["testGroups"]
+        group_index = -1
+        group = None
+        index = -1
+        mct = None      # (tg, tc, resultsArray) of the monte carlo test being collected
+        for kind, item in iter_records(path):
+            if kind == 'section':
+                if mct is not None:
+                    yield (filename, mct[0], mct[1], {'resultsArray': mct[2]})
+                    mct = None
+                group_index += 1
+                if group_index >= len(groups):
+                    raise ValueError("%s: more sections than test groups (%d)" % (filename, len(groups)))
+                group = groups[group_index]
+                index = -1
+                continue
+            if group is None:
+                continue
+
+            if owners[id(group['tests'][0])]['testType'] == 'MCT':
+                if mct is None or alg.legacy_response_starts_test(group, item):
+                    if mct is not None:
+                        yield (filename, mct[0], mct[1], {'resultsArray': mct[2]})
+                    index += 1
+                    tc = _test_case(filename, group, index)
+                    mct = (owners[id(tc)], tc, [])
+                fields = alg.legacy_response_fields(mct[0], mct[1], item)
+                if fields is not None:
+                    mct[2].append(fields)
+                continue
+
+            index += 1
+            tc = _test_case(filename, group, index)
+            tg = owners[id(tc)]
+            fields = alg.legacy_response_fields(tg, tc, item)
+            if fields is not None:
+                yield (filename, tg, tc, fields)
+
+        if mct is not None:
+            yield (filename, mct[0], mct[1], {'resultsArray': mct[2]})
+
+
+def build_response(alg, responses):
+    """Assemble the ACVP response [header, vectorSet] from iter_responses output,
+    with test groups and test cases in vector set order."""
+    answers = {}
+    for filename, tg, tc, fields in responses:
+        answers.setdefault(tg['tgId'], {})[tc['tcId']] = fields
+
+    testGroups = []
+    for tg in alg.testGroups:
+        if tg['tgId'] not in answers:
+            continue
+        tests = []
+        for tc in tg['tests']:
+            if tc['tcId'] in answers[tg['tgId']]:
+                test = OrderedDict([('tcId', tc['tcId'])])
+                test.update(sorted(answers[tg['tgId']][tc['tcId']].items()))
+                tests.append(test)
+        testGroups.append(OrderedDict([('tgId', tg['tgId']), ('tests', tests)]))
+
+    vector_set = OrderedDict()
+    for k in ('vsId', 'algorithm', 'mode', 'revision'):
+        if k in alg._vectors:
+            vector_set[k] = alg._vectors[k]
+    vector_set['testGroups'] = testGroups
+    return [{"acvVersion": alg._headers.get('acvVersion')}, vector_set]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print >> sys.stderr, "usage: rsp.py vector-set.json rsp-dir [response.json]"
+        return 2
+
+    with open(argv[0]) as f:
+        a = registry.for_json(acvpjson.load(f))
+        plan = a.legacy_plan()
+    response = build_response(a, iter_responses(a, argv[1], plan))
+
+    if len(argv) > 2:
+        with open(argv[2], "wt") as output:
+            json.dump(response, output, indent=2)
+    else:
+        json.dump(response, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,47 @@
-import json
+import os
 import sys
 import time
-from pdb import set_trace as bp
-from cavsalg import CAVSAlgorithm
+from cavsalg import CAVSAlgorithm, lower_column, expected_column, expected_results, DEBUG_TTY
+import acvpjson
+import instrument
+
+# Size of the pieces LDT messages are expanded in, in bytes of message (twice that in hex)
+LDT_CHUNK_BYTES = 512 * 1024
+
+
+def expand_large_message(large_msg, chunk_bytes=LDT_CHUNK_BYTES):
+    """Yield the lower case hex of an LDT largeMsg piece by piece; the whole message
+    (up to gigabytes) is never held in memory.  Only the "repeating" expansion of
+    byte-oriented content is known."""
+    technique = large_msg.get('expansionTechnique', 'repeating')
+    if technique != 'repeating':
+        raise RuntimeError("Unknown LDT expansion technique %s" % technique)
+    content_len = int(large_msg['contentLength'])
+    full_len = int(large_msg['fullLength'])
+    if content_len % 8 or full_len % 8 or content_len <= 0:
+        raise RuntimeError("Bit-oriented LDT message (content %d bits, full %d bits) is not supported" % (content_len, full_len))
+
+    content = large_msg['content'][:content_len / 4].lower()
+    # Every chunk is a whole number of repetitions, so they all start with the content
+    block = content * max(1, chunk_bytes * 2 / len(content))
+    remaining = full_len / 4
+    while remaining >= len(block):
+        yield block
+        remaining -= len(block)
+    if remaining:
+        yield block[:remaining]
+
+
+def message_length(tc):
+    """Length in bits of the message of a test case, LDT or not."""
+    if 'largeMsg' in tc:
+        return int(tc['largeMsg']['fullLength'])
+    return int(tc['len'])
 
 
 class SHA(CAVSAlgorithm):
+    _test_case_decorations = ('_testCaseSubType',)
+
     def __init__(self, alg):
         if not alg.startswith('SHA'):
             raise RuntimeError("Algorithm %s is not a secure hash algorithm." % alg)
@@ -34,11 +70,11 @@ class SHA(CAVSAlgorithm):
             # We only want the END number as the output size (last 3 digits)
             self._outputSize = int(alg[-3:])
 
-        print "Alg: %s, bs: %s, os: %s" % (alg, self._blockSize, self._outputSize)
+        instrument.event("algorithm", algorithm=alg, blockSize=self._blockSize, outputSize=self._outputSize)
 
 
     def legacy_file_groups(self):
-        """Legacy file groups are <alg>(LongMsg|ShortMsg|Monte).req
+        """Legacy file groups are <alg>(LongMsg|ShortMsg|Monte|LDT).req
         These details are scattered throughout the vector set and we need to recapture them.
         Alg is already known.
         Return a list of the filenames along with the grouping criteria needed to generate them.
@@ -64,18 +100,98 @@ class SHA(CAVSAlgorithm):
     def generate_legacy_group_record(self, group):
         return "[L = " + str(int(self._outputSize)/8) + "]"
 
+    # Record layouts for the Monte seed and the Len/Msg message tests
+    _SEED = "Seed = %s"
+    _RECORD = "Len = %s\nMsg = %s"
+
+    def render_legacy_test_group(self, group, tests=None):
+        tests = group["tests"] if tests is None else tests
+        records = []
+        for test, msg in zip(tests, lower_column(tests, 'msg')):
+            if test['_testCaseSubType'] == 'Monte':
+                records.append(self._SEED % msg)
+            else:
+                if int(test['len']) == 0:
+                    msg = "00"
+                records.append(self._RECORD % (test['len'], msg))
+        return records
+
     def generate_legacy_test_case_record(self, group, test):
-        if test['_testCaseSubType'] == 'Monte':
-            res = "Seed = %s" % test['msg'].lower()
-        else:
-            msg = test['msg'].lower()
-            if int(test['len']) == 0:
-                msg = "00"
+        return self.render_legacy_test_group(group, [test])[0]
 
-            res = """Len = {length}
-Msg = {msg}""".format(length=test['len'], msg=msg)
+    def render_legacy_test_group_chunks(self, group):
+        if group.get('_testSubType') != 'LDT':
+            return super(SHA, self).render_legacy_test_group_chunks(group)
+        return self._render_large_messages(group)
+
+    # Monte iterations following the seed in the answer files
+    _MONTE_ANSWER = "\n\nCOUNT = %d\nMD = %s"
+
+    def legacy_answer_records(self, group, tests, records):
+        answers = []
+        for test, record in zip(tests, records):
+            if test['_testCaseSubType'] == 'Monte':
+                mds = expected_column(expected_results(test), 'md', test)
+                answers.append(record + "".join([self._MONTE_ANSWER % (i, md) for i, md in enumerate(mds)]))
+            else:
+                answers.append(record + "\nMD = " + expected_column([test], 'md')[0])
+        return answers
 
-        return res
+    def render_legacy_answer_chunks(self, group):
+        if group.get('_testSubType') != 'LDT':
+            return super(SHA, self).render_legacy_answer_chunks(group)
+        return self._render_large_messages(group, answers=True)
+
+    def legacy_group_stub(self, group):
+        # The header wants the sub type of the first test case of a file and whether any
+        # length is odd; the first test case of every sub type and parity will do for both
+        stub = super(SHA, self).legacy_group_stub(group)
+        seen = set()
+        for tc in group['tests']:
+            key = (tc['_testCaseSubType'], message_length(tc) % 2)
+            if key not in seen:
+                seen.add(key)
+                stub['tests'].append(tc)
+        return stub
+
+    def legacy_group_fits_in_memory(self, group):
+        # LDT messages run into gigabytes; they are only ever streamed out
+        return group.get('_testSubType') != 'LDT'
+
+    def _render_large_messages(self, group, answers=False):
+        """Len/Msg records of the LDT test cases, with Msg streamed out as it is expanded.
+        With answers, (.req chunk, answer chunk) pairs as for render_legacy_answer_chunks;
+        the expanded message is the same on both sides."""
+        algorithm = self._vectors.get('algorithm')
+        for test in group['tests']:
+            head = "\nLen = %d\nMsg = " % message_length(test)
+            yield (head, head) if answers else head
+            start = time.time()
+            size = 0
+            for chunk in expand_large_message(test['largeMsg']):
+                size += len(chunk)
+                yield (chunk, chunk) if answers else chunk
+            if answers:
+                yield "\n", "\nMD = %s\n" % expected_column([test], 'md')[0]
+            else:
+                yield "\n"
+
+            # The time includes writing the chunks out: this is the end to end rate
+            seconds = time.time() - start
+            mb_per_s = size / seconds / (1024 * 1024) if seconds else None
+            instrument.observe("ldt_expand", seconds, algorithm=algorithm)
+            instrument.count("ldt_bytes", size, algorithm=algorithm)
+            instrument.event("ldt_expanded", algorithm=algorithm, tcId=test['tcId'], bytes=size, seconds=seconds, mb_per_s=mb_per_s)
+
+
+    def legacy_response_fields(self, group, test, record):
+        # The Monte seed is repeated in the response ahead of the COUNT/MD records
+        if 'MD' not in record:
+            return None
+        return {"md": record['MD'].upper()}
+
+    def legacy_response_starts_test(self, group, record):
+        return 'Seed' in record
 
 
     def generate_legacy_header(self, groups, py_timestamp):
@@ -93,7 +209,7 @@ Msg = {msg}""".format(length=test['len'], msg=msg)
         # Because SHA is split in test cases instead of test groups, we process it this way
         for tc in groups[0]['tests']:
             # If odd, then bit-oriented
-            if int(tc['len']) % 2:
+            if message_length(tc) % 2:
                 mode = 'BIT'
                 break
 
@@ -116,7 +232,11 @@ Msg = {msg}""".format(length=test['len'], msg=msg)
                 tc['_testCaseSubType'] = 'Monte'
             return 'Monte'
 
-        print "%s %s" % (self.algorithm, tg['tgId'])
+        if tg["testType"] == 'LDT':
+            # Large data tests go to their own <alg>LDT.req
+            for tc in tg['tests']:
+                tc['_testCaseSubType'] = 'LDT'
+            return 'LDT'
 
         # For this, we need to actually subdivide the test cases themselves...
         for tc in tg["tests"]:
@@ -126,21 +246,34 @@ Msg = {msg}""".format(length=test['len'], msg=msg)
                 tc['_testCaseSubType'] = 'LongMsg'
             else:
                 raise RuntimeError("Unknown test case sub type for test case %s in group %s" % (tc['tcId'], tg['tgId']))
-            self._add_to_index('_testCaseSubType', tc)
 
         return tg["testType"]        # Default is to return the actual test type
 
+    def legacy_index_group(self, tg):
+        super(SHA, self).legacy_index_group(tg)
+        if tg['_testSubType'] not in ('Monte', 'LDT'):
+            # ShortMsg and LongMsg files are made of test cases rather than groups
+            for tc in tg['tests']:
+                self._add_to_index('_testCaseSubType', tc)
+
+
+def converter(vs):
+    """Registry factory (see registry.py)."""
+    return SHA(vs['algorithm'])
+
 
 if __name__ == "__main__":
-    j = json.loads("\n".join(sys.stdin.readlines()))
-    # To help with debugging with pdb after reading from stdin
-    sys.stdin = open('/dev/tty')
+    j = acvpjson.load(sys.stdin)
+    if os.environ.get(DEBUG_TTY):
+        # To help with debugging with pdb; the reader keeps its own handle on the original stdin
+        sys.stdin = open('/dev/tty')
 
     try:
         outdir = sys.argv[1]
     except IndexError:
         outdir = "."
 
-    a = SHA(j[1]['algorithm'])
+    # Not registry.for_json, which would import this file again as a module of its own
+    a = converter(j[1])
     a.json = j
     a.to_cavs(outdir)
@@ -0,0 +1,90 @@
+"""Tests for the streaming ACVP reader.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+
+
+class Pipe(object):
+    """A stream which cannot seek, like stdin from a pipe."""
+    def __init__(self, text):
+        self._f = StringIO(text)
+
+    def read(self, size=-1):
+        return self._f.read(size)
+
+
+GROUPS = [{"tgId": 1, "tests": [{"tcId": 1, "msg": "00"}, {"tcId": 2, "msg": '[]{}"\\'}]},
+          {"tgId": 2, "tests": [{"tcId": 3, "msg": "ff" * 100}]}]
+
+
+def document(keys):
+    """An ACVP document whose vectorSet has keys (pairs) in that order, by hand so the
+    order is kept."""
+    vector_set = ", ".join("%s: %s" % (json.dumps(k), json.dumps(v)) for k, v in keys)
+    return '[{"acvVersion": "1.0"}, {%s}]' % vector_set
+
+
+def read(text, chunk_size=acvpjson.CHUNK_SIZE, stream=StringIO):
+    j = acvpjson.load(stream(text), chunk_size)
+    vector_set = j[1]
+    algorithm = vector_set.get('algorithm')
+    if 'testGroups' in vector_set:
+        vector_set['testGroups'] = list(vector_set['testGroups'])
+    return j, algorithm
+
+
+class StreamReaderTest(unittest.TestCase):
+    def check(self, keys, **kwargs):
+        text = document(keys)
+        j, algorithm = read(text, **kwargs)
+        self.assertEqual(j, json.loads(text))
+        # Known before the test groups are read
+        self.assertEqual(algorithm, json.loads(text)[1].get('algorithm'))
+
+    def test_key_orders(self):
+        keys = [("vsId", 1), ("algorithm", "SHA-1"), ("revision", "1.0"), ("testGroups", GROUPS)]
+        for i in xrange(len(keys)):
+            self.check(keys[i:] + keys[:i])
+
+    def test_keys_after_test_groups(self):
+        keys = [("testGroups", GROUPS), ("algorithm", "ACVP-AES-ECB"), ("mode", None), ("isSample", True)]
+        self.check(keys)
+        self.check(keys, stream=Pipe)
+
+    def test_trailing_keys_come_with_the_groups(self):
+        j = acvpjson.load(StringIO(document([("algorithm", "SHA-1"), ("testGroups", GROUPS), ("vsId", 7)])))
+        self.assertFalse('vsId' in j[1])
+        self.assertEqual(list(j[1]['testGroups']), GROUPS)
+        self.assertEqual(j[1]['vsId'], 7)
+
+    def test_chunk_boundaries(self):
+        for keys in ([("algorithm", "SHA-1"), ("testGroups", GROUPS), ("vsId", 12345)],
+                     [("vsId", 12345), ("testGroups", GROUPS), ("algorithm", "SHA-1")]):
+            for chunk_size in xrange(1, 40):
+                self.check(keys, chunk_size=chunk_size)
+                self.check(keys, chunk_size=chunk_size, stream=Pipe)
+
+    def test_empty_test_groups(self):
+        self.check([("algorithm", "SHA-1"), ("testGroups", [])])
+        self.check([("testGroups", []), ("algorithm", "SHA-1")])
+        self.check([("testGroups", []), ("algorithm", "SHA-1")], stream=Pipe)
+        self.check([("algorithm", "SHA-1"), ("testGroups", [])], chunk_size=1)
+
+    def test_no_test_groups(self):
+        self.check([("algorithm", "SHA-1")])
+        j, algorithm = read('[{}, {}]')
+        self.assertEqual(j, [{}, {}])
+
+    def test_truncated(self):
+        text = document([("algorithm", "SHA-1"), ("testGroups", GROUPS)])
+        j = acvpjson.load(StringIO(text[:-20]))
+        self.assertRaises(ValueError, list, j[1]['testGroups'])
+
+
+if __name__ == "__main__":
+    unittest.main()
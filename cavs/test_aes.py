@@ -0,0 +1,66 @@
+"""Tests for the AES converter helpers.
+
+    python -m unittest discover -s cavs
+"""
+import random
+import unittest
+
+import aes
+
+
+def baseline_cfb1_bits(hex_value, payload_len):
+    # cfb1_bits as the original converter wrote it
+    return "{:0{width}b}".format(int(hex_value[::-1], 16) & int("0b" + ('1' * payload_len), 2), width=payload_len)
+
+
+class CFB1BitsTest(unittest.TestCase):
+    def setUp(self):
+        aes._cfb1_cache.clear()
+
+    def check(self, hex_value, payload_len):
+        expected = baseline_cfb1_bits(hex_value, payload_len)
+        self.assertEqual(aes.cfb1_bits(hex_value, payload_len), expected, (hex_value, payload_len))
+        # Again, from the cache
+        self.assertEqual(aes.cfb1_bits(hex_value, payload_len), expected, (hex_value, payload_len))
+
+    def test_random(self):
+        rnd = random.Random(1)
+        for _ in xrange(2000):
+            hex_value = ''.join(rnd.choice('0123456789abcdefABCDEF') for _ in xrange(rnd.randint(1, 40)))
+            self.check(hex_value, rnd.randint(1, 4 * len(hex_value) + 8))
+
+    def test_every_payload_len_mod_8(self):
+        for hex_value in ('00', '80', '01', 'ff', '1234', 'a5a5a5a5'):
+            for payload_len in xrange(1, 4 * len(hex_value) + 9):
+                self.check(hex_value, payload_len)
+
+    def test_odd_nibble_counts(self):
+        for hex_value in ('8', 'f', '123', 'abcde', '0123456'):
+            for payload_len in xrange(1, 4 * len(hex_value) + 5):
+                self.check(hex_value, payload_len)
+
+    def test_empty(self):
+        self.assertRaises(ValueError, baseline_cfb1_bits, '', 1)
+        self.assertRaises(ValueError, aes.cfb1_bits, '', 1)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, aes.cfb1_bits, '8g', 8)
+        self.assertRaises(ValueError, aes.cfb1_bits, '80', 0)
+
+    def test_cache_keeps_working_when_full(self):
+        for i in xrange(aes.CFB1_CACHE_SIZE + 10):
+            self.check('%x' % i, 16)
+        self.assertTrue(0 < len(aes._cfb1_cache) <= aes.CFB1_CACHE_SIZE)
+        self.assertTrue(('%x' % (aes.CFB1_CACHE_SIZE + 9), 16) in aes._cfb1_cache)
+
+    def test_cfb1_hex_inverse(self):
+        rnd = random.Random(2)
+        for payload_len in xrange(1, 40):
+            bits = ''.join(rnd.choice('01') for _ in xrange(payload_len))
+            hex_value = aes.cfb1_hex(bits)
+            self.assertEqual(len(hex_value) % 2, 0)
+            self.assertEqual(aes.cfb1_bits(hex_value, payload_len), bits)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""Tests for the conversion cache.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+import batch
+import cache
+import registry
+import vectorgen
+
+
+def load(text):
+    return registry.for_json(acvpjson.load(StringIO(text)))
+
+
+def contents(out_dir):
+    res = {}
+    for filename in os.listdir(out_dir):
+        with open(os.path.join(out_dir, filename), 'rb') as f:
+            res[filename] = f.read()
+    return res
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.text = json.dumps(vectorgen.aes('ECB'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def out(self, name):
+        out_dir = os.path.join(self.dir, name)
+        os.makedirs(out_dir)
+        return out_dir
+
+    def test_miss_then_hit(self):
+        c = cache.ConversionCache(self.cache_dir)
+        first = self.out('first')
+        files = load(self.text).to_cavs(first, cache=c)
+        self.assertEqual(c.stats(), {"hits": 0, "misses": 1, "stores": 1, "evictions": 0})
+
+        second = self.out('second')
+        a = load(self.text)
+        self.assertEqual(a.to_cavs(second, cache=c), files)
+        self.assertEqual(a.written_files, files)
+        self.assertEqual((c.hits, c.misses), (1, 1))
+        # Byte for byte, the "Generated on" line of the first conversion included
+        self.assertEqual(contents(second), contents(first))
+
+    def test_other_inputs_miss(self):
+        c = cache.ConversionCache(self.cache_dir)
+        load(self.text).to_cavs(self.out('all'), cache=c)
+        load(self.text).to_cavs(self.out('answers'), cache=c, answers=True)
+
+        a = load(self.text)
+        a.select({'keyLen': 128})
+        selected = a.to_cavs(self.out('selected'), cache=c)
+        self.assertTrue(all('128' in filename for filename in selected))
+
+        other = json.loads(self.text)
+        other[1]['testGroups'][0]['tests'][0]['pt'] = 'AB' * 16
+        load(json.dumps(other)).to_cavs(self.out('other'), cache=c)
+        self.assertEqual((c.hits, c.misses), (0, 4))
+
+    def test_copies_unless_linking(self):
+        c = cache.ConversionCache(self.cache_dir)
+        first = self.out('first')
+        load(self.text).to_cavs(first, cache=c)
+        copied = self.out('copied')
+        files = load(self.text).to_cavs(copied, cache=c)
+        path = os.path.join(copied, files[0])
+        self.assertEqual(os.stat(path).st_nlink, 1)
+        # An output edited in place leaves the cache entry alone
+        with open(path, 'ab') as f:
+            f.write('edited in place\n')
+        again = self.out('again')
+        load(self.text).to_cavs(again, cache=c)
+        self.assertEqual(contents(again), contents(first))
+
+        linked = self.out('linked')
+        load(self.text).to_cavs(linked, cache=cache.ConversionCache(self.cache_dir, link=True))
+        self.assertTrue(os.stat(os.path.join(linked, files[0])).st_nlink > 1)
+
+    def test_least_recently_used_go_first(self):
+        src = self.out('src')
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(src, name), 'wb') as f:
+                f.write('x' * 100)
+        c = cache.ConversionCache(self.cache_dir, max_bytes=250)
+        c.store('aa' * 32, src, ['a'])
+        c.store('bb' * 32, src, ['b'])
+        past = time.time() - 3600
+        os.utime(c._entry_dir('aa' * 32), (past, past))
+        os.utime(c._entry_dir('bb' * 32), (past + 60, past + 60))
+        # Using a refreshes it, so b is the least recently used one now
+        self.assertEqual(c.fetch('aa' * 32, self.out('fetched')), ['a'])
+
+        c.store('cc' * 32, src, ['c'])
+        self.assertEqual(c.evictions, 1)
+        self.assertEqual(c.fetch('bb' * 32, self.out('gone')), None)
+        self.assertEqual(sorted(os.path.basename(e[2]) for e in c.entries()), ['aa' * 32, 'cc' * 32])
+
+    def test_batch_hit(self):
+        path = os.path.join(self.dir, 'AES-ECB.json')
+        with open(path, 'w') as f:
+            f.write(self.text)
+        options = {"cache_dir": self.cache_dir}
+        first = batch.convert_all([path], os.path.join(self.dir, 'first'), 1, options)[0]
+        second = batch.convert_all([path], os.path.join(self.dir, 'second'), 1, options)[0]
+        self.assertEqual((first["cache"]["misses"], second["cache"]["hits"]), (1, 1))
+        self.assertEqual(second["files"], first["files"])
+        self.assertEqual(contents(os.path.join(self.dir, 'second', 'AES-ECB')),
+                         contents(os.path.join(self.dir, 'first', 'AES-ECB')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Tests for the test group index.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch
+import groupindex
+import vectorgen
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'SHA-1.json')
+        with open(self.path, 'w') as f:
+            json.dump(vectorgen.sha('SHA-1'), f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_only_saved_on_request(self):
+        groupindex.load_index(self.path)
+        self.assertFalse(os.path.exists(groupindex.index_path(self.path)))
+        index = groupindex.load_index(self.path, persist=True)
+        self.assertTrue(os.path.exists(groupindex.index_path(self.path)))
+        self.assertEqual(groupindex.load_index(self.path), index)
+
+    def test_directory_with_an_index(self):
+        groupindex.load_index(self.path, persist=True)
+        self.assertEqual(batch.expand_inputs([self.dir]), [self.path])
+        out = os.path.join(self.dir, 'out')
+        results = batch.convert_all(batch.expand_inputs([self.dir]), out, workers=1)
+        self.assertEqual([r["ok"] for r in results], [True])
+
+    def test_show_index_needs_no_output(self):
+        self.assertEqual(groupindex.main([self.path, '--show-index']), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Tests for merging HMAC vector sets into one HMAC.req.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+import hmac
+import vectorgen
+
+
+def merged_sections(algorithms):
+    """Merge the vectorgen vector sets of algorithms (streamed, in the order given) and
+    return the (section, records) of the HMAC.req, records being dicts."""
+    out = tempfile.mkdtemp()
+    try:
+        vector_sets = [acvpjson.load(StringIO(json.dumps(vectorgen.hmac(alg)))) for alg in algorithms]
+        filename = hmac.merge_to_cavs(vector_sets, out)
+        with open(os.path.join(out, filename)) as f:
+            text = f.read()
+    finally:
+        shutil.rmtree(out)
+
+    sections = []
+    for block in text.split("\n\n"):
+        block = block.strip()
+        if block.startswith('['):
+            sections.append((block, []))
+        elif block.startswith('Count'):
+            sections[-1][1].append(dict(line.split(" = ") for line in block.splitlines()))
+    return sections
+
+
+class MergeTest(unittest.TestCase):
+    def test_one_section_per_hash(self):
+        algorithms = ['HMAC-SHA2-512', 'HMAC-SHA2-256', 'HMAC-SHA-1', 'HMAC-SHA2-384', 'HMAC-SHA2-224']
+        sections = merged_sections(algorithms)
+        self.assertEqual([s for s, _ in sections], ["[L=20 SHAAlg=SHA_1]", "[L=28 SHAAlg=SHA_2]", "[L=32 SHAAlg=SHA_2]",
+                                                     "[L=48 SHAAlg=SHA_2]", "[L=64 SHAAlg=SHA_2]"])
+        for (section, records), alg in zip(sections, sorted(algorithms, key=lambda alg: hmac.HMAC(alg).merge_key())):
+            tests = [tc for tg in vectorgen.hmac(alg)[1]['testGroups'] for tc in tg['tests']]
+            self.assertEqual(len(records), len(tests))
+            self.assertEqual([int(r['Count']) for r in records], range(len(records)))
+            self.assertEqual([r['Key'] for r in records], [tc['key'].lower() for tc in tests])
+            # The MAC length goes in Tlen, up to the output size
+            outlen = int(re.match(r'\[L=(\d+)', section).group(1))
+            tlens = set(int(r['Tlen']) for r in records)
+            self.assertTrue(len(tlens) > 1 and max(tlens) == outlen)
+
+    def test_truncated_hash_has_its_own_section(self):
+        a = hmac.HMAC('HMAC-SHA2-224')
+        b = hmac.HMAC('HMAC-SHA2-512/224')
+        self.assertNotEqual(a.legacy_merged_record(), b.legacy_merged_record())
+        self.assertTrue(a.merge_key() < b.merge_key())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Tests for incremental conversions.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+import emit
+import registry
+import vectorgen
+
+
+def load(vector_set):
+    return registry.for_json(acvpjson.load(StringIO(json.dumps(vector_set))))
+
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vector_set = vectorgen.aes('ECB')
+        self.files = self.convert(self.vector_set)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def convert(self, vector_set, **kwargs):
+        self.alg = load(vector_set)
+        kwargs.setdefault('incremental', True)
+        return self.alg.to_cavs(self.dir, **kwargs)
+
+    def filename_of(self, tgId):
+        for file_groups in load(self.vector_set).legacy_plan():
+            if tgId in [tg['tgId'] for tg in file_groups['testGroups']]:
+                return file_groups['filename']
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertEqual(sorted(self.alg.written_files), sorted(self.files))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, emit.MANIFEST_FILENAME)))
+        self.assertEqual(self.convert(self.vector_set), self.files)
+        self.assertEqual((self.alg.written_files, self.alg.removed_files), ([], []))
+
+    def test_changed_and_missing_files_are_rewritten(self):
+        self.vector_set[1]['testGroups'][0]['tests'][0]['pt'] = 'AB' * 16
+        changed = self.filename_of(self.vector_set[1]['testGroups'][0]['tgId'])
+        os.unlink(os.path.join(self.dir, self.files[-1]))
+        self.convert(self.vector_set)
+        self.assertEqual(sorted(self.alg.written_files), sorted([changed, self.files[-1]]))
+        with open(os.path.join(self.dir, changed)) as f:
+            self.assertTrue('ab' * 16 in f.read().lower())
+
+    def test_dropped_files_are_deleted(self):
+        self.vector_set[1]['testGroups'] = [tg for tg in self.vector_set[1]['testGroups'] if tg['keyLen'] != 256]
+        files = self.convert(self.vector_set)
+        dropped = sorted(filename for filename in self.files if '256' in filename)
+        self.assertEqual(self.alg.written_files, [])
+        self.assertEqual(self.alg.removed_files, dropped)
+        self.assertEqual(sorted(files), sorted(set(self.files) - set(dropped)))
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(files + [emit.MANIFEST_FILENAME]))
+
+    def test_full_conversion_forgets_the_manifest(self):
+        self.convert(self.vector_set, incremental=False)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, emit.MANIFEST_FILENAME)))
+        self.convert(self.vector_set)
+        self.assertEqual(sorted(self.alg.written_files), sorted(self.files))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Tests for converting with group workers.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+import registry
+import vectorgen
+
+VECTOR_SETS = [lambda: vectorgen.aes('ECB'), lambda: vectorgen.aes('CBC'), lambda: vectorgen.aes('CFB1'),
+               lambda: vectorgen.aes('CTR'), lambda: vectorgen.sha('SHA-1'), lambda: vectorgen.sha('SHA2-512'),
+               lambda: vectorgen.hmac('HMAC-SHA2-256')]
+
+
+def load(text):
+    return registry.for_json(acvpjson.load(StringIO(text)))
+
+
+def contents(out_dir):
+    res = {}
+    for filename in os.listdir(out_dir):
+        with open(os.path.join(out_dir, filename), 'rb') as f:
+            res[filename] = f.read()
+    return res
+
+
+class GroupWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # Same "Generated on" line in every file; the forked workers inherit it
+        self._time = time.time
+        time.time = lambda: 1500000000.0
+
+    def tearDown(self):
+        time.time = self._time
+        shutil.rmtree(self.dir)
+
+    def convert(self, text, workers=1, chunk_groups=None):
+        out = tempfile.mkdtemp(dir=self.dir)
+        a = load(text)
+        if workers > 1:
+            a.use_workers(workers, chunk_groups)
+        files = a.to_cavs(out)
+        return files, contents(out)
+
+    def test_same_files_as_serial(self):
+        for make in VECTOR_SETS:
+            text = json.dumps(make())
+            files, serial = self.convert(text)
+            self.assertTrue(serial)
+            self.assertEqual(self.convert(text, 2), (files, serial), make()[1]['algorithm'])
+
+    def test_one_group_at_a_time(self):
+        text = json.dumps(vectorgen.aes('ECB'))
+        self.assertEqual(self.convert(text, 3, chunk_groups=1), self.convert(text))
+
+    def test_selection(self):
+        text = json.dumps(vectorgen.aes('ECB'))
+        outputs = []
+        for workers in (1, 2):
+            out = tempfile.mkdtemp(dir=self.dir)
+            a = load(text)
+            a.use_workers(workers)
+            a.select({'keyLen': 192})
+            outputs.append((a.to_cavs(out), contents(out)))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertTrue(all('192' in filename for filename in outputs[0][0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Tests for pipelined conversions.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+import registry
+import vectorgen
+
+
+def load(text):
+    return registry.for_json(acvpjson.load(StringIO(text)))
+
+
+def contents(out_dir):
+    res = {}
+    for filename in os.listdir(out_dir):
+        with open(os.path.join(out_dir, filename), 'rb') as f:
+            res[filename] = f.read()
+    return res
+
+
+def split_sha(algorithm, count):
+    """vectorgen.sha with its AFT test cases dealt out over count AFT groups, so the
+    ShortMsg and LongMsg files are made of the test cases of several groups."""
+    j = vectorgen.sha(algorithm)
+    aft, mct = j[1]['testGroups']
+    groups = [dict(aft, tgId=i + 1, tests=aft['tests'][i::count]) for i in xrange(count)]
+    mct['tgId'] = count + 1
+    j[1]['testGroups'] = groups + [mct]
+    return j
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # Same "Generated on" line in every file
+        self._time = time.time
+        time.time = lambda: 1500000000.0
+
+    def tearDown(self):
+        time.time = self._time
+        shutil.rmtree(self.dir)
+
+    def check(self, vector_set, selection=None):
+        text = json.dumps(vector_set)
+        outputs = []
+        for pipeline in (False, True):
+            out = tempfile.mkdtemp(dir=self.dir)
+            a = load(text)
+            if selection is not None:
+                a.select(selection)
+            outputs.append((sorted(a.to_cavs(out, pipeline=pipeline)), contents(out)))
+        self.assertTrue(outputs[0][0])
+        self.assertEqual(outputs[1], outputs[0], vector_set[1]['algorithm'])
+        return outputs[0][1]
+
+    def test_aes(self):
+        for mode in ('ECB', 'CBC', 'CFB1', 'CTR'):
+            self.check(vectorgen.aes(mode))
+
+    def test_sha(self):
+        for algorithm in ('SHA-1', 'SHA2-384'):
+            self.check(vectorgen.sha(algorithm))
+
+    def test_sha_several_aft_groups(self):
+        for count in (2, 3):
+            files = self.check(split_sha('SHA2-256', count))
+            self.assertEqual(sorted(files), ['SHA256LongMsg.req', 'SHA256Monte.req', 'SHA256ShortMsg.req'])
+            # One group record per file, the test cases of every group under it
+            short = files['SHA256ShortMsg.req']
+            self.assertEqual(short.count('[L = 32]'), 1)
+            self.assertEqual(short.count('Len = '), 65)
+
+    def test_hmac(self):
+        self.check(vectorgen.hmac('HMAC-SHA2-256'))
+
+    def test_selection(self):
+        self.check(vectorgen.aes('ECB'), {'keyLen': 256})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for checking responses against the expected results.
+
+    python -m unittest discover -s cavs
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import acvpjson
+import registry
+import vectorgen
+import verify
+
+FILENAME = 'ECBGFSbox128.rsp'
+
+
+def load(text):
+    return registry.for_json(acvpjson.load(StringIO(text)))
+
+
+class VerifyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.text = json.dumps(vectorgen.aes('ECB'))
+        load(self.text).to_cavs(self.dir, answers=True)
+        self.expected = verify.load_expected(StringIO(self.text))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def verify(self):
+        return verify.verify(load(self.text), self.expected, self.dir)
+
+    def edit(self, change):
+        path = os.path.join(self.dir, FILENAME)
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(change(text))
+
+    def test_answers_pass(self):
+        report = self.verify()
+        self.assertTrue(report.ok)
+        tests = [tc for tg in json.loads(self.text)[1]['testGroups'] for tc in tg['tests']]
+        self.assertEqual(report.totals(), {"checked": len(tests), "failed": 0, "missing": 0, "unexpected": 0})
+
+    def test_mismatch(self):
+        self.edit(lambda text: re.sub(r'CIPHERTEXT = \w+', 'CIPHERTEXT = ' + 'ab' * 16, text, 1))
+        report = self.verify()
+        self.assertFalse(report.ok)
+        self.assertEqual(report.totals()["failed"], 1)
+        failed = [g for g in report if not g.ok]
+        self.assertEqual([g.filename for g in failed], [FILENAME])
+        self.assertEqual(len(failed[0].details), 1)
+        details = failed[0].details[0]
+        self.assertEqual((details["field"], details["got"].lower()), ("ct", 'ab' * 16))
+        self.assertEqual(details["expected"], self.expected[(failed[0].tgId, details["tcId"])]["ct"])
+
+    def test_missing_and_unexpected(self):
+        self.edit(lambda text: re.sub(r'COUNT = 1\n(.+\n)+\n', '', text, 1))
+        del self.expected[sorted(self.expected)[-1]]
+        report = self.verify()
+        self.assertFalse(report.ok)
+        self.assertEqual((report.totals()["missing"], report.totals()["unexpected"]), (1, 1))
+
+    def test_report(self):
+        self.edit(lambda text: re.sub(r'CIPHERTEXT = \w+', 'CIPHERTEXT = ' + 'ab' * 16, text, 1))
+        out = StringIO()
+        self.verify().write(out)
+        failed = [line for line in out.getvalue().splitlines() if line.startswith('FAIL')]
+        self.assertEqual(len(failed), 1)
+        self.assertTrue(FILENAME in failed[0])
+        self.assertTrue(out.getvalue().endswith(", 1 failed, 0 missing, 0 unexpected\n"))
+        self.assertEqual(json.loads(json.dumps(self.verify().to_json()))["totals"]["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
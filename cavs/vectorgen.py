@@ -0,0 +1,227 @@
+"""Synthetic ACVP vector sets, for benchmarks and for trying the converters out.
+
+The vector sets have the shape of the real ones (test types, directions, key sizes and
+the CAVS-style AES known answer patterns the classifiers look for) but the values are
+pseudo random: expected results are NOT the real answers.  Generation is deterministic
+for a given algorithm and scale.
+
+    python cavs/vectorgen.py out/ [scale]
+"""
+import json
+import os
+import random
+import sys
+from collections import OrderedDict
+
+AES_MODES = ('ECB', 'CBC', 'OFB', 'CFB1', 'CFB8', 'CFB128', 'CTR')
+SHA_ALGORITHMS = ('SHA-1', 'SHA2-224', 'SHA2-256', 'SHA2-384', 'SHA2-512')
+HMAC_ALGORITHMS = ('HMAC-SHA-1', 'HMAC-SHA2-224', 'HMAC-SHA2-256', 'HMAC-SHA2-384', 'HMAC-SHA2-512')
+
+# Iterations reported for every monte carlo test case
+MCT_ITERATIONS = 100
+
+# Message size of the large data test, in megabytes per unit of scale (real ones are 1-8 GB)
+LDT_MB = 64
+
+
+def _envelope(algorithm, groups, vsId=1):
+    """[header, vectorSet] with testGroups last, the way the server sends them."""
+    vector_set = OrderedDict([('vsId', vsId), ('algorithm', algorithm), ('revision', '1.0')])
+    vector_set['testGroups'] = groups
+    return [OrderedDict([('acvVersion', '1.0')]), vector_set]
+
+
+class _Values(object):
+    """Pseudo random hex strings, upper case like the ACVP server sends them."""
+    def __init__(self, seed):
+        self._random = random.Random(seed)
+
+    def hex(self, nbytes):
+        return ''.join('%02X' % self._random.randrange(256) for _ in xrange(nbytes))
+
+    def bit(self):
+        return '80' if self._random.random() < .5 else '00'
+
+    @staticmethod
+    def zeros(nbytes):
+        return '00' * nbytes
+
+    @staticmethod
+    def walking_ones(nbits, i):
+        """The i-th VarKey/VarTxt value: i+1 one bits shifted in from the left."""
+        return '%0*X' % (nbits / 4, ((1 << (i + 1)) - 1) << (nbits - i - 1))
+
+
+# Test cases per group of the AES known answer tests, as in the CAVS files (VarKey and
+# VarTxt have one per bit of the key and block).
+_AES_KAT_COUNTS = {'GFSbox': 7, 'KeySbox': 21, 'VarTxt': 128, 'MMT': 10}
+
+
+def _aes_test_case(values, mode, subType, direction, keyLen, i):
+    streaming = mode in ('OFB', 'CFB1', 'CFB8', 'CFB128')
+    block = 1 if mode in ('CFB1', 'CFB8') else 16
+    kb = keyLen / 8
+
+    if subType == 'MMT':
+        key, iv, txt = values.hex(kb), values.hex(16), values.hex(block * (i + 1))
+    elif subType == 'GFSbox':
+        key = values.zeros(kb)
+        if streaming:
+            iv, txt = values.hex(16), values.zeros(block)
+        else:
+            iv, txt = values.zeros(16), values.hex(block)
+    elif subType == 'KeySbox':
+        key, iv, txt = values.hex(kb), values.zeros(16), values.zeros(block)
+    elif subType == 'VarKey':
+        key, iv, txt = values.walking_ones(keyLen, i % keyLen), values.zeros(16), values.zeros(block)
+    else:   # VarTxt
+        key = values.zeros(kb)
+        if streaming:
+            iv, txt = values.walking_ones(128, i % 128), values.zeros(block)
+        else:
+            iv, txt = values.zeros(16), values.walking_ones(128, i % 128)
+
+    tc = OrderedDict([('key', key)])
+    if mode != 'ECB':
+        tc['iv'] = iv
+    tc['pt'] = txt
+    tc['ct'] = values.hex(len(txt) / 2)
+    if mode == 'CFB1':
+        tc['payloadLen'] = 1
+        tc['pt'] = values.bit() if subType == 'MMT' or direction == 'decrypt' else '00'
+        tc['ct'] = values.bit()
+    return tc
+
+
+def aes(mode, scale=1):
+    """ACVP-AES-<mode> vector set: both directions and all key sizes, one group per CAVS
+    sub type (or plain AFT groups for CTR) plus a monte carlo group."""
+    values = _Values('AES-' + mode)
+    groups = []
+    tgId = tcId = 1
+    for direction in ('encrypt', 'decrypt'):
+        for keyLen in (128, 192, 256):
+            subTypes = ('CTR',) if mode == 'CTR' else ('GFSbox', 'KeySbox', 'VarKey', 'VarTxt', 'MMT')
+            for subType in subTypes:
+                count = keyLen if subType == 'VarKey' else _AES_KAT_COUNTS.get(subType, 32)
+                tests = []
+                for i in xrange(count * scale):
+                    if subType == 'CTR':
+                        tc = OrderedDict([('key', values.hex(keyLen / 8)), ('iv', values.hex(16)),
+                                          ('pt', values.hex(16 * (i % 4 + 1)))])
+                        tc['ct'] = values.hex(len(tc['pt']) / 2)
+                    else:
+                        tc = _aes_test_case(values, mode, subType, direction, keyLen, i % count)
+                    tc['tcId'] = tcId
+                    tcId += 1
+                    tests.append(tc)
+                groups.append(OrderedDict([('tgId', tgId), ('testType', 'AFT'), ('direction', direction),
+                                           ('keyLen', keyLen), ('tests', tests)]))
+                tgId += 1
+
+            if mode == 'CTR':
+                continue
+            tc = OrderedDict([('tcId', tcId), ('key', values.hex(keyLen / 8))])
+            if mode != 'ECB':
+                tc['iv'] = values.hex(16)
+            tc['pt' if direction == 'encrypt' else 'ct'] = '80' if mode == 'CFB1' else values.hex(16)
+            if mode == 'CFB1':
+                tc['payloadLen'] = 1
+            # CFB1 monte carlo iterations go a bit at a time, as its payloads do
+            text = values.bit if mode == 'CFB1' else lambda: values.hex(16)
+            tc['resultsArray'] = [OrderedDict([('key', values.hex(keyLen / 8)), ('pt', text()), ('ct', text())])
+                                  for _ in xrange(MCT_ITERATIONS)]
+            tcId += 1
+            groups.append(OrderedDict([('tgId', tgId), ('testType', 'MCT'), ('direction', direction),
+                                       ('keyLen', keyLen), ('tests', [tc])]))
+            tgId += 1
+    return _envelope('ACVP-AES-' + mode, groups)
+
+
+def sha(algorithm, scale=1, ldt_mb=None):
+    """SHA vector set: every byte length up to the block size (ShortMsg), a block size
+    multiple worth of long messages (LongMsg) and a monte carlo test.  With ldt_mb, a
+    large data test group too, with a message of that many megabytes."""
+    values = _Values(algorithm)
+    block = 1024 if algorithm in ('SHA2-384', 'SHA2-512') else 512
+    digest = 20 if algorithm == 'SHA-1' else int(algorithm[-3:]) / 8
+
+    tests = []
+    tcId = 1
+    for _ in xrange(scale):
+        for length in xrange(0, block + 1, 8):
+            tests.append(OrderedDict([('tcId', tcId), ('msg', values.hex(length / 8) or '00'), ('len', length), ('md', values.hex(digest))]))
+            tcId += 1
+        for i in xrange(1, block / 8 + 1):
+            length = block + 99 * 8 * i
+            tests.append(OrderedDict([('tcId', tcId), ('msg', values.hex(length / 8)), ('len', length), ('md', values.hex(digest))]))
+            tcId += 1
+
+    monte = OrderedDict([('tcId', tcId), ('msg', values.hex(digest)), ('len', digest * 8),
+                         ('resultsArray', [OrderedDict([('md', values.hex(digest))]) for _ in xrange(MCT_ITERATIONS)])])
+    groups = [OrderedDict([('tgId', 1), ('testType', 'AFT'), ('tests', tests)]),
+              OrderedDict([('tgId', 2), ('testType', 'MCT'), ('tests', [monte])])]
+    if ldt_mb:
+        large = OrderedDict([('content', values.hex(3)), ('contentLength', 24), ('fullLength', ldt_mb * 1024 * 1024 * 8),
+                             ('expansionTechnique', 'repeating')])
+        ldt = OrderedDict([('tcId', tcId + 1), ('largeMsg', large), ('md', values.hex(digest))])
+        groups.append(OrderedDict([('tgId', 3), ('testType', 'LDT'), ('tests', [ldt])]))
+    return _envelope(algorithm, groups)
+
+
+def hmac(algorithm, scale=1):
+    """HMAC vector set with a group for every key length (shorter than, equal to and
+    longer than the block size) and every MAC length from 32 bits up to the output size."""
+    values = _Values(algorithm)
+    output = 160 if algorithm == 'HMAC-SHA-1' else int(algorithm[-3:])
+    block = 1024 if output > 256 else 512
+
+    groups = []
+    tgId = tcId = 1
+    for keyLen in (output / 2, output, block, block * 2):
+        for macLen in xrange(32, output + 1, 32):
+            tests = []
+            for _ in xrange(15 * scale):
+                tests.append(OrderedDict([('tcId', tcId), ('key', values.hex(keyLen / 8)), ('msg', values.hex(128)),
+                                          ('mac', values.hex(macLen / 8))]))
+                tcId += 1
+            groups.append(OrderedDict([('tgId', tgId), ('testType', 'AFT'), ('keyLen', keyLen), ('msgLen', 1024),
+                                       ('macLen', macLen), ('tests', tests)]))
+            tgId += 1
+    return _envelope(algorithm, groups)
+
+
+def vector_sets(scale=1):
+    """(name, generator) of every synthetic vector set; call generator() to build it."""
+    res = []
+    for mode in AES_MODES:
+        res.append(('AES-%s' % mode, lambda mode=mode: aes(mode, scale)))
+    for algorithm in SHA_ALGORITHMS:
+        res.append((algorithm, lambda algorithm=algorithm: sha(algorithm, scale)))
+    res.append(('SHA2-256-LDT', lambda: sha('SHA2-256', scale, ldt_mb=LDT_MB * scale)))
+    for algorithm in HMAC_ALGORITHMS:
+        res.append((algorithm, lambda algorithm=algorithm: hmac(algorithm, scale)))
+    return res
+
+
+def write(out_dir, scale=1, names=None):
+    """Write the vector sets (all, or those named) into out_dir; return their paths."""
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    paths = []
+    for name, generate in vector_sets(scale):
+        if names is not None and name not in names:
+            continue
+        path = os.path.join(out_dir, '%s.json' % name)
+        with open(path, 'wt') as f:
+            json.dump(generate(), f, indent=2)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print >> sys.stderr, "usage: vectorgen.py out-dir [scale]"
+        sys.exit(2)
+    for path in write(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1):
+        print path
@@ -0,0 +1,188 @@
+"""Check CAVS responses against the ACVP expected results before submitting them.
+
+The expected results file has the layout of the vector set ([header, vectorSet] with
+testGroups/tests), holding the answers.  They are indexed by (tgId, tcId), then the
+.rsp files are read once (rsp.iter_responses) and every answer is looked up in that
+index.  Mismatches are reported per response file and test group.
+
+    python cavs/verify.py vector-set.json expected.json rsp-dir/ [--json report.json]
+
+The vector set itself will do as expected.json when it carries the answers.
+"""
+import argparse
+import json
+import os
+import sys
+
+import acvpjson
+import registry
+import rsp
+
+# Mismatches listed per group in the report; the rest are only counted
+MAX_DETAILS = 10
+
+
+def load_expected(stream):
+    """Index the tests of an expected results file by (tgId, tcId).  The file is streamed
+    in a test group at a time, but every expected test case is held in the index (the
+    rest of the groups is not), so memory grows with the number of test cases."""
+    index = {}
+    for tg in acvpjson.load(stream)[1]['testGroups']:
+        tgId = tg['tgId']
+        for tc in tg['tests']:
+            index[(tgId, tc['tcId'])] = tc
+    return index
+
+
+def _same(expected, got):
+    # Both sides are normally upper case hex already; only compare case-insensitively
+    # when the plain comparison fails.
+    return expected == got or (isinstance(expected, basestring) and isinstance(got, basestring)
+                                and expected.upper() == got.upper())
+
+
+def compare(expected, fields):
+    """(field, expected, got) for every response field which differs from the expected
+    test case.  Fields the expected side does not have are not checked."""
+    res = []
+    for k, got in fields.iteritems():
+        if k not in expected:
+            continue
+        exp = expected[k]
+        if k == 'resultsArray':
+            if len(exp) != len(got):
+                res.append(('resultsArray', "%d iterations" % len(exp), "%d iterations" % len(got)))
+            for i, (e, g) in enumerate(zip(exp, got)):
+                for field, value in g.iteritems():
+                    if field in e and not _same(e[field], value):
+                        res.append(('resultsArray[%d].%s' % (i, field), e[field], value))
+        elif not _same(exp, got):
+            res.append((k, exp, got))
+    return res
+
+
+class GroupResult(object):
+    def __init__(self, filename, tgId):
+        self.filename = filename
+        self.tgId = tgId
+        self.checked = 0
+        self.failed = 0
+        self.missing = 0
+        self.unexpected = 0
+        self.details = []
+
+    def add(self, tcId, mismatches):
+        self.checked += 1
+        if mismatches:
+            self.failed += 1
+            for field, exp, got in mismatches:
+                if len(self.details) < MAX_DETAILS:
+                    self.details.append({"tcId": tcId, "field": field, "expected": exp, "got": got})
+
+    @property
+    def ok(self):
+        return not (self.failed or self.missing or self.unexpected)
+
+    def to_json(self):
+        return {"file": self.filename, "tgId": self.tgId, "checked": self.checked, "failed": self.failed,
+                "missing": self.missing, "unexpected": self.unexpected, "mismatches": self.details}
+
+
+class Report(object):
+    """Verification results, per (response file, tgId) in the order they were met."""
+    def __init__(self):
+        self._groups = {}
+        self._order = []
+
+    def group(self, filename, tgId):
+        key = (filename, tgId)
+        if key not in self._groups:
+            self._groups[key] = GroupResult(filename, tgId)
+            self._order.append(key)
+        return self._groups[key]
+
+    def __iter__(self):
+        return (self._groups[key] for key in self._order)
+
+    @property
+    def ok(self):
+        return all(g.ok for g in self)
+
+    def totals(self):
+        res = {"checked": 0, "failed": 0, "missing": 0, "unexpected": 0}
+        for g in self:
+            for k in res:
+                res[k] += getattr(g, k)
+        return res
+
+    def to_json(self):
+        return {"ok": self.ok, "totals": self.totals(), "groups": [g.to_json() for g in self]}
+
+    def write(self, stream=sys.stdout):
+        for g in self:
+            status = "OK  " if g.ok else "FAIL"
+            print >> stream, "%s  %s tgId %s: %d checked, %d failed, %d missing, %d unexpected" % (
+                status, g.filename, g.tgId, g.checked, g.failed, g.missing, g.unexpected)
+            for d in g.details:
+                print >> stream, "        tcId %s %s: expected %s, got %s" % (d["tcId"], d["field"], d["expected"], d["got"])
+        t = self.totals()
+        print >> stream, "%d test case(s) checked, %d failed, %d missing, %d unexpected" % (
+            t["checked"], t["failed"], t["missing"], t["unexpected"])
+
+
+def verify(alg, expected, rsp_dir, plan=None):
+    """Join the responses in rsp_dir against the expected index (load_expected) and
+    return a Report.  Test cases of a response file without an answer count as missing,
+    answers without an expected result as unexpected."""
+    if plan is None:
+        plan = alg.legacy_plan()
+    report = Report()
+    answered = set()
+    for filename, tg, tc, fields in rsp.iter_responses(alg, rsp_dir, plan):
+        key = (tg['tgId'], tc['tcId'])
+        answered.add(key)
+        group = report.group(filename, tg['tgId'])
+        exp = expected.get(key)
+        if exp is None:
+            group.unexpected += 1
+            continue
+        group.add(tc['tcId'], compare(alg.legacy_response_expected(tg, tc, exp), fields))
+
+    # Whatever the response files should have answered, but did not
+    owners = rsp.test_owners(alg)
+    for file_groups in plan:
+        filename = rsp.response_filename(file_groups["filename"])
+        if not os.path.exists(os.path.join(rsp_dir, filename)):
+            continue
+        for g in file_groups["testGroups"]:
+            for tc in g['tests']:
+                tgId = owners[id(tc)]['tgId']
+                if (tgId, tc['tcId']) not in answered:
+                    report.group(filename, tgId).missing += 1
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check CAVS .rsp files against ACVP expected results.")
+    parser.add_argument("vector_set", help="the ACVP vector set the .req files were made from")
+    parser.add_argument("expected", help="ACVP expected results for it")
+    parser.add_argument("rsp_dir", help="directory of the .rsp files")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.vector_set) as f:
+        a = registry.for_json(acvpjson.load(f))
+        plan = a.legacy_plan()
+    with open(args.expected) as f:
+        expected = load_expected(f)
+
+    report = verify(a, expected, args.rsp_dir, plan)
+    report.write()
+    if args.json:
+        with open(args.json, "wt") as f:
+            json.dump(report.to_json(), f, indent=2)
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())